@@ -0,0 +1,179 @@
+"""End to end CoinBLAS benchmarks on a synthetic chain.
+
+Imports a SyntheticSource chain into an empty CoinBLAS database, then
+times graph construction, finalization, block file writes, merging,
+the derived adjacency products and address traversals.  Results are
+written as JSON so runs can be compared across commits:
+
+    python benchmarks/bench_chain.py --db "$COINBLAS_DB" --output new.json
+    python benchmarks/bench_chain.py --compare old.json new.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from time import perf_counter
+
+
+class Timer:
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    @contextmanager
+    def __call__(self, name):
+        tic = perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += perf_counter() - tic
+            self.calls[name] += 1
+
+
+def git_revision():
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        out = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=here)
+        return out.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    import pygraphblas
+    from coinblas.bitcoin import Chain, Address
+    from coinblas.bitcoin.synthetic import SyntheticSource
+
+    source = SyntheticSource(
+        blocks=args.blocks,
+        txs_per_block=args.txs_per_block,
+        fan_in=args.fan_in,
+        fan_out=args.fan_out,
+        address_reuse=args.address_reuse,
+        seed=args.seed,
+    )
+    block_path = args.block_path or tempfile.mkdtemp(prefix="coinblas-bench-")
+    chain = Chain(args.db, block_path, args.pool_size, source=source)
+    timer = Timer()
+
+    with timer("initialize_blocks"):
+        chain.initialize_blocks()
+
+    blocks = list(source.blocks())
+    months = sorted({b["timestamp_month"] for b in blocks})
+    counts = defaultdict(int)
+    for month in months:
+        chain.create_month(month)
+        rows = source.transactions(month)
+        for _, group in groupby(rows, itemgetter("b_number")):
+            group = list(group)
+            counts["rows"] += len(group)
+            with timer("build_block_graph"):
+                with timer("parse_block"):
+                    block = chain.parse_block(group)
+                counts["txs"] += len(block.pending_txs)
+                with chain.conn.cursor() as curs:
+                    with timer("finalize.build_graphs"):
+                        block.build_graphs(curs)
+                    with timer("write_block_files"):
+                        block.write_block_files(chain.block_path)
+                    with timer("finalize.write_rows"):
+                        block.write_rows(curs, month)
+                chain.conn.commit()
+            counts["blocks"] += 1
+        chain.flush()
+        with timer("index_and_attach"):
+            chain.index_and_attach(month)
+            chain.conn.commit()
+
+    chain.load_blockspan(blocks[0]["number"], blocks[-1]["number"])
+    for suffix in ("BT", "IT", "TO", "SI", "OR", "ST", "TR"):
+        with timer(f"merge_block_graphs.{suffix}"):
+            setattr(chain, suffix, chain.merge_block_graphs(suffix))
+        counts[f"nvals.{suffix}"] = getattr(chain, suffix).nvals
+
+    for name in ("IO", "SR", "TT"):
+        with timer(f"product.{name}"):
+            counts[f"nvals.{name}"] = getattr(chain, name).nvals
+
+    senders = [a for a, _ in chain.ST.reduce_vector()]
+    rnd = random.Random(args.seed)
+    for a_id in rnd.sample(senders, min(args.traversals, len(senders))):
+        address = Address(chain, a_id)
+        for bfs in ("bfs_level", "bfs_parent", "bfs_exposure"):
+            with timer(f"Address.{bfs}"):
+                getattr(address, bfs)(args.depth)
+
+    return dict(
+        revision=git_revision(),
+        python=sys.version.split()[0],
+        platform=platform.platform(),
+        pygraphblas=getattr(pygraphblas, "__version__", None),
+        params=dict(
+            blocks=args.blocks,
+            txs_per_block=args.txs_per_block,
+            fan_in=args.fan_in,
+            fan_out=args.fan_out,
+            address_reuse=args.address_reuse,
+            seed=args.seed,
+            pool_size=args.pool_size,
+            depth=args.depth,
+            traversals=args.traversals,
+        ),
+        counts=dict(counts),
+        seconds=dict(timer.seconds),
+        calls=dict(timer.calls),
+    )
+
+
+def compare(old, new):
+    with open(old) as f:
+        old = json.load(f)
+    with open(new) as f:
+        new = json.load(f)
+    print(f"{'timing':<32} {'old':>10} {'new':>10} {'ratio':>8}")
+    for name in sorted(set(old["seconds"]) | set(new["seconds"])):
+        o = old["seconds"].get(name)
+        n = new["seconds"].get(name)
+        ratio = f"{n / o:8.2f}" if o and n else f"{'-':>8}"
+        fo = f"{o:10.4f}" if o is not None else f"{'-':>10}"
+        fn = f"{n:10.4f}" if n is not None else f"{'-':>10}"
+        print(f"{name:<32} {fo} {fn} {ratio}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CoinBLAS benchmarks")
+    parser.add_argument("--db", default=os.getenv("COINBLAS_DB"), help="Postgres DB")
+    parser.add_argument("--block-path", help="Block file path, a temp dir by default")
+    parser.add_argument("--blocks", default=100, type=int)
+    parser.add_argument("--txs-per-block", default=500, type=int)
+    parser.add_argument("--fan-in", default=2, type=int)
+    parser.add_argument("--fan-out", default=2, type=int)
+    parser.add_argument("--address-reuse", default=0.5, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--pool-size", default=1, type=int)
+    parser.add_argument("--depth", default=6, type=int, help="BFS depth")
+    parser.add_argument("--traversals", default=10, type=int, help="BFS sources")
+    parser.add_argument("--output", help="Write JSON results here")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files"
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        results = run(args)
+        out = json.dumps(results, indent=2, sort_keys=True)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(out)
+        print(out)
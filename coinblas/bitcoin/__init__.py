@@ -1,5 +1,10 @@
-from .chain import Chain, logger
+from .chain import Chain, ChainSlice, logger
 from .block import Block
+from .rollup import Rollup
 from .tx import Tx
 from .spend import Spend
 from .address import Address
+from .entity import Entities
+from .compact import Compact
+from .flow import Flow
+from .source import Source, BigQuerySource, RecordSource, ReplaySource
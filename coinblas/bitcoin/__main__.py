@@ -4,16 +4,58 @@ if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="CoinBLAS")
-    parser.add_argument("mode", default="query", help="query|init|summary")
+    parser.add_argument("mode", default="query", help="query|init|import|rollup|follow|profile|summary")
     parser.add_argument("--start", help="Start block number")
     parser.add_argument("--end", help="End block number")
     parser.add_argument("--start-date", help="Start block number")
     parser.add_argument("--end-date", help="End block number")
     parser.add_argument("--pool-size", default="1", type=int, help="Pool Size")
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Load all block matrices up front in query mode",
+    )
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Import with COPY in large batches across blocks",
+    )
+    parser.add_argument(
+        "--shard-blocks",
+        default=256,
+        type=int,
+        help="Blocks per shard handed to an import worker",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        default=60,
+        type=float,
+        help="Seconds between polls for new blocks in follow mode",
+    )
     parser.add_argument("--db", default=os.getenv("COINBLAS_DB"), help="Postgres DB")
     parser.add_argument(
         "--block-path", default=os.getenv("COINBLAS_PATH"), help="Block file Path"
     )
+    parser.add_argument(
+        "--blk-path",
+        default=os.getenv("COINBLAS_BLK_PATH"),
+        help="Import from this bitcoind blocks directory instead of BigQuery",
+    )
+    parser.add_argument(
+        "--replay", help="Import rows recorded under this path instead of BigQuery"
+    )
+    parser.add_argument("--record", help="Record imported rows under this path")
+    parser.add_argument(
+        "--matrix-budget",
+        type=float,
+        help="Gigabytes of merged and derived matrices to keep in memory",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Write metrics here on exit, Prometheus text if it ends in .prom "
+        "and JSON lines otherwise",
+    )
+    parser.add_argument("--trace", help="Append every timed span here as JSON lines")
     parser.add_argument(
         "--log-level",
         default=os.getenv("COINBLAS_LOG_LEVEL", "INFO"),
@@ -22,28 +64,82 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     from coinblas.bitcoin import Chain, logger
+    from coinblas.metrics import metrics
     from coinblas.util import *
 
+    if args.trace:
+        metrics.trace = open(args.trace, "a", buffering=1)
+
     logger.setLevel(getattr(logging, args.log_level.upper()))
 
-    btc = Chain(args.db, args.block_path, args.pool_size)
+    from coinblas.bitcoin.source import BigQuerySource, RecordSource, ReplaySource
+
+    source = BigQuerySource()
+    if args.blk_path:
+        from coinblas.bitcoin.blkfile import BlkFileReader
+
+        source = BlkFileReader(args.blk_path, args.pool_size)
+    elif args.replay:
+        source = ReplaySource(args.replay)
+    if args.record:
+        source = RecordSource(source, args.record)
+
+    btc = Chain(
+        args.db,
+        args.block_path,
+        args.pool_size,
+        bulk=args.bulk,
+        source=source,
+        matrix_budget=args.matrix_budget and int(args.matrix_budget * (1 << 30)),
+    )
 
     if args.mode == "init":
         btc.initialize_blocks()
         if args.start_date and args.end_date:
-            btc.import_blocktime(args.start_date, args.end_date)
+            btc.import_blocktime(
+                args.start_date, args.end_date, shard_blocks=args.shard_blocks
+            )
 
     elif args.mode == "import":
-        btc.import_blocktime(args.start_date, args.end_date)
+        btc.import_blocktime(
+            args.start_date, args.end_date, shard_blocks=args.shard_blocks
+        )
 
-    elif args.mode == "query":
+    elif args.mode == "rollup":
+        btc.rollup_blocktime(args.start_date, args.end_date)
+
+    elif args.mode in ("query", "follow"):
         import IPython
 
         if args.start and args.end:
             btc.load_blockspan(args.start, args.end)
         elif args.start_date and args.end_date:
             btc.load_blocktime(args.start_date, args.end_date)
+        if args.prefetch:
+            btc.load_graphs()
+        if args.mode == "follow":
+            btc.follow(args.poll_interval, background=True)
         IPython.embed()
 
+    elif args.mode == "profile":
+        # profile the same sharded import as import mode, blocks that are
+        # already imported are skipped so only the rest is measured
+        months = btc.months(args.start_date, args.end_date)
+        if not any(btc.pending_blocks(month) for month in months):
+            logger.warning(
+                "Every block in the range is imported, profiling only loading."
+            )
+        btc.import_blocktime(
+            args.start_date, args.end_date, shard_blocks=args.shard_blocks
+        )
+        btc.load_blocktime(args.start_date, args.end_date)
+        btc.load_graphs()
+        for name in ("IO", "SR", "TT"):
+            getattr(btc, name)
+        print(metrics.report())
+
     elif args.mode == "summary":
         print(btc.summary)
+
+    if args.metrics:
+        metrics.write(args.metrics)
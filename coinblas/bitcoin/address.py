@@ -1,10 +1,8 @@
 from time import time
 
 from coinblas.util import (
-    curse,
     get_block_number,
     maximal_vector,
-    query,
     lazy,
 )
 
@@ -24,6 +22,9 @@ from pygraphblas import (
 from .tx import Tx
 from .spend import Spend
 
+ALPHA = 14
+BETA = 24
+
 
 class Address:
     def __init__(self, chain, id, address=None):
@@ -33,16 +34,8 @@ class Address:
             self.address = address
 
     @lazy
-    @curse
-    @query
-    def address(self, curs):
-        """
-        SELECT a_address FROM bitcoin.address WHERE a_id = {self.id}
-        """
-        r = curs.fetchone()
-        if r is None:
-            return
-        return r[0]
+    def address(self):
+        return self.chain.resolver.get("address", self.id)
 
     @property
     def sent_vector(self):
@@ -50,7 +43,7 @@ class Address:
 
     @property
     def received_vector(self):
-        return self.chain.OR[:, self.id]
+        return self.chain.OR_T[self.id, :]
 
     @property
     def sent(self):
@@ -68,29 +61,56 @@ class Address:
 
     @property
     def txs_as_receiver_vector(self):
-        return self.chain.TR[:, self.id]
+        return self.chain.TR_T[self.id, :]
 
     @property
     def txs_as_sender(self):
-        for a_id, t_id in self.txs_as_sender_vector:
+        txs = [t_id for t_id, _ in self.txs_as_sender_vector]
+        self.chain.resolver.want("tx", txs)
+        for t_id in txs:
             yield Tx(self.chain, id=t_id)
 
     @property
     def txs_as_receiver(self):
-        for t_id, a_id in self.txs_as_receiver_vector:
+        txs = [t_id for t_id, _ in self.txs_as_receiver_vector]
+        self.chain.resolver.want("tx", txs)
+        for t_id in txs:
             yield Tx(self.chain, id=t_id)
 
+    def bfs_step(self, q, pi, pull):
+        """Advance frontier ``q`` one level, masked by the complement of
+        ``pi``, pushing through SR or pulling through its transpose."""
+        if pull:
+            self.chain.SR_T.mxv(q, out=q, mask=pi, desc=descriptor.RSC)
+        else:
+            q.vxm(self.chain.SR, out=q, mask=pi, desc=descriptor.RSC)
+
+    def bfs_direction(self, pull, q, pi):
+        """Beamer's direction optimizing heuristic.
+
+        Pushing costs the out edges of the frontier and pulling the in
+        edges of the unvisited addresses, so pull once the frontier is
+        more than 1/ALPHA of the unvisited addresses and push again once
+        it shrinks below 1/BETA of all addresses.
+        """
+        n = self.chain.SR_receivers
+        if not pull:
+            return q.nvals > (n - pi.nvals) / ALPHA
+        return q.nvals >= n / BETA
+
     def bfs_level(self, depth=lib.GxB_INDEX_MAX):
         SR = self.chain.SR
         q = maximal_vector(INT64)
         pi = q.dup()
         q[self.id] = 0
+        pull = False
         for level in range(min(depth + 1, SR.nvals)):
             with semiring.ANY_PAIR_INT64:
-                q.vxm(SR, out=q, mask=pi, desc=descriptor.RSC)
+                self.bfs_step(q, pi, pull)
             if not q:
                 break
             pi.assign_scalar(level + 1, mask=q, desc=descriptor.S)
+            pull = self.bfs_direction(pull, q, pi)
         return pi
 
     def bfs_parent(self, depth=lib.GxB_INDEX_MAX):
@@ -98,12 +118,14 @@ class Address:
         q = maximal_vector(INT64)
         pi = q.dup()
         q[self.id] = self.id
+        pull = False
         for level in range(min(depth + 1, SR.nvals)):
             with semiring.ANY_SECONDI_INT64:
-                q.vxm(SR, out=q, mask=pi, desc=descriptor.RSC)
+                self.bfs_step(q, pi, pull)
             if not q:
                 break
             pi.assign(q, mask=q, desc=descriptor.S)
+            pull = self.bfs_direction(pull, q, pi)
         return pi
 
     def bfs_exposure(self, depth=lib.GxB_INDEX_MAX):
@@ -111,12 +133,14 @@ class Address:
         q = maximal_vector(INT64)
         pi = q.dup()
         q[self.id] = lib.GxB_INDEX_MAX
+        pull = False
         for level in range(min(depth + 1, SR.nvals)):
             with semiring.MIN_MIN_INT64:
-                q.vxm(SR, out=q, mask=pi, desc=descriptor.RSC)
+                self.bfs_step(q, pi, pull)
             if not q:
                 break
             pi.assign(q, mask=q, desc=descriptor.S)
+            pull = self.bfs_direction(pull, q, pi)
         return pi
 
     def __repr__(self):
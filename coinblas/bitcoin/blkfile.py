@@ -0,0 +1,545 @@
+"""Read blocks straight from a bitcoind ``blocks`` directory.
+
+``BlkFileReader`` produces the same block and transaction rows as the
+BigQuery queries in ``Chain``, so blocks parsed from local ``blk*.dat``
+files get identical blocktime ids and go through the same
+``build_block_graph`` path.
+"""
+import hashlib
+import struct
+from datetime import date, datetime, timezone
+from multiprocessing import Pool
+from pathlib import Path
+
+from coinblas.util import lazy, unload
+
+from .source import Source
+
+MAGIC = bytes.fromhex("f9beb4d9")
+NULL_HASH = "00" * 32
+COINBASE_INDEX = 0xFFFFFFFF
+
+B58 = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BECH32 = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32M_CONST = 0x2BC830A3
+
+OP_CHECKSIG = 0xAC
+OP_CHECKMULTISIG = 0xAE
+
+
+def dsha256(b):
+    return hashlib.sha256(hashlib.sha256(b).digest()).digest()
+
+
+# RIPEMD-160, used when the local OpenSSL no longer provides it.
+
+_RL = [
+    *range(16),
+    *(7, 4, 13, 1, 10, 6, 15, 3, 12, 0, 9, 5, 2, 14, 11, 8),
+    *(3, 10, 14, 4, 9, 15, 8, 1, 2, 7, 0, 6, 13, 11, 5, 12),
+    *(1, 9, 11, 10, 0, 8, 12, 4, 13, 3, 7, 15, 14, 5, 6, 2),
+    *(4, 0, 5, 9, 7, 12, 2, 10, 14, 1, 3, 8, 11, 6, 15, 13),
+]
+_RR = [
+    *(5, 14, 7, 0, 9, 2, 11, 4, 13, 6, 15, 8, 1, 10, 3, 12),
+    *(6, 11, 3, 7, 0, 13, 5, 10, 14, 15, 8, 12, 4, 9, 1, 2),
+    *(15, 5, 1, 3, 7, 14, 6, 9, 11, 8, 12, 2, 10, 0, 4, 13),
+    *(8, 6, 4, 1, 3, 11, 15, 0, 5, 12, 2, 13, 9, 7, 10, 14),
+    *(12, 15, 10, 4, 1, 5, 8, 7, 6, 2, 13, 14, 0, 3, 9, 11),
+]
+_SL = [
+    *(11, 14, 15, 12, 5, 8, 7, 9, 11, 13, 14, 15, 6, 7, 9, 8),
+    *(7, 6, 8, 13, 11, 9, 7, 15, 7, 12, 15, 9, 11, 7, 13, 12),
+    *(11, 13, 6, 7, 14, 9, 13, 15, 14, 8, 13, 6, 5, 12, 7, 5),
+    *(11, 12, 14, 15, 14, 15, 9, 8, 9, 14, 5, 6, 8, 6, 5, 12),
+    *(9, 15, 5, 11, 6, 8, 13, 12, 5, 12, 13, 14, 11, 8, 5, 6),
+]
+_SR = [
+    *(8, 9, 9, 11, 13, 15, 15, 5, 7, 7, 8, 11, 14, 14, 12, 6),
+    *(9, 13, 15, 7, 12, 8, 9, 11, 7, 7, 12, 7, 6, 15, 13, 11),
+    *(9, 7, 15, 11, 8, 6, 6, 14, 12, 13, 5, 14, 13, 13, 7, 5),
+    *(15, 5, 8, 11, 14, 14, 6, 14, 6, 9, 12, 9, 12, 5, 15, 8),
+    *(8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11),
+]
+_KL = (0x00000000, 0x5A827999, 0x6ED9EBA1, 0x8F1BBCDC, 0xA953FD4E)
+_KR = (0x50A28BE6, 0x5C4DD124, 0x6D703EF3, 0x7A6D76E9, 0x00000000)
+_M = 0xFFFFFFFF
+
+
+def _rol(x, n):
+    return ((x << n) | (x >> (32 - n))) & _M
+
+
+def _f(j, x, y, z):
+    if j == 0:
+        return x ^ y ^ z
+    if j == 1:
+        return (x & y) | (~x & z)
+    if j == 2:
+        return (x | ~y) ^ z
+    if j == 3:
+        return (x & z) | (y & ~z)
+    return x ^ (y | ~z)
+
+
+def ripemd160(msg):
+    msg = bytes(msg)
+    bits = len(msg) * 8
+    msg += b"\x80" + b"\x00" * ((55 - len(msg)) % 64) + struct.pack("<Q", bits)
+    h = [0x67452301, 0xEFCDAB89, 0x98BADCFE, 0x10325476, 0xC3D2E1F0]
+    for block in range(0, len(msg), 64):
+        X = struct.unpack("<16I", msg[block : block + 64])
+        al, bl, cl, dl, el = h
+        ar, br, cr, dr, er = h
+        for j in range(80):
+            r = j >> 4
+            t = _rol((al + _f(r, bl, cl, dl) + X[_RL[j]] + _KL[r]) & _M, _SL[j])
+            al, el, dl, cl, bl = el, dl, _rol(cl, 10), bl, (t + el) & _M
+            t = _rol((ar + _f(4 - r, br, cr, dr) + X[_RR[j]] + _KR[r]) & _M, _SR[j])
+            ar, er, dr, cr, br = er, dr, _rol(cr, 10), br, (t + er) & _M
+        h = [
+            (h[1] + cl + dr) & _M,
+            (h[2] + dl + er) & _M,
+            (h[3] + el + ar) & _M,
+            (h[4] + al + br) & _M,
+            (h[0] + bl + cr) & _M,
+        ]
+    return struct.pack("<5I", *h)
+
+
+def hash160(b):
+    try:
+        return hashlib.new("ripemd160", hashlib.sha256(b).digest()).digest()
+    except ValueError:
+        return ripemd160(hashlib.sha256(b).digest())
+
+
+def base58check(version, payload):
+    data = bytes([version]) + payload
+    data += dsha256(data)[:4]
+    n = int.from_bytes(data, "big")
+    out = ""
+    while n:
+        n, r = divmod(n, 58)
+        out = B58[r] + out
+    pad = len(data) - len(data.lstrip(b"\x00"))
+    return "1" * pad + out
+
+
+def _bech32_polymod(values):
+    gen = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+    chk = 1
+    for v in values:
+        b = chk >> 25
+        chk = ((chk & 0x1FFFFFF) << 5) ^ v
+        for i in range(5):
+            if (b >> i) & 1:
+                chk ^= gen[i]
+    return chk
+
+
+def _convertbits(data, frombits, tobits):
+    acc = bits = 0
+    out = []
+    maxv = (1 << tobits) - 1
+    for value in data:
+        acc = (acc << frombits) | value
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            out.append((acc >> bits) & maxv)
+    if bits:
+        out.append((acc << (tobits - bits)) & maxv)
+    return out
+
+
+def segwit_address(version, program, hrp="bc"):
+    data = [version] + _convertbits(program, 8, 5)
+    const = 1 if version == 0 else BECH32M_CONST
+    expanded = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded + data + [0] * 6) ^ const
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(BECH32[d] for d in data + checksum)
+
+
+def _pushes(script):
+    """Split a script into its data pushes and opcodes, None if malformed."""
+    ops = []
+    pos = 0
+    while pos < len(script):
+        op = script[pos]
+        pos += 1
+        if 0 < op < 0x4C:
+            size = op
+        elif op == 0x4C:
+            size = script[pos]
+            pos += 1
+        elif op == 0x4D:
+            size = struct.unpack_from("<H", script, pos)[0]
+            pos += 2
+        elif op == 0x4E:
+            size = struct.unpack_from("<I", script, pos)[0]
+            pos += 4
+        else:
+            ops.append(op)
+            continue
+        if pos + size > len(script):
+            return None
+        ops.append(script[pos : pos + size])
+        pos += size
+    return ops
+
+
+def script_addresses(script):
+    """Addresses paid by an output script, as bitcoind reports them.
+
+    Pay to pubkey and bare multisig outputs are reported as the P2PKH
+    addresses of their keys, anything else unrecognised as
+    ``nonstandard`` followed by the sha256 of the script.
+    """
+    n = len(script)
+    if n == 25 and script[:3] == b"\x76\xa9\x14" and script[23:] == b"\x88\xac":
+        return [base58check(0x00, script[3:23])]
+    if n == 23 and script[:2] == b"\xa9\x14" and script[22] == 0x87:
+        return [base58check(0x05, script[2:22])]
+    if n in (22, 34) and script[0] == 0 and script[1] == n - 2:
+        return [segwit_address(0, script[2:])]
+    if 4 <= n <= 42 and 0x51 <= script[0] <= 0x60 and script[1] == n - 2:
+        return [segwit_address(script[0] - 0x50, script[2:])]
+    ops = _pushes(script)
+    if (
+        ops
+        and len(ops) == 2
+        and ops[1] == OP_CHECKSIG
+        and isinstance(ops[0], bytes)
+        and len(ops[0]) in (33, 65)
+    ):
+        return [base58check(0x00, hash160(ops[0]))]
+    if (
+        ops
+        and len(ops) >= 4
+        and ops[-1] == OP_CHECKMULTISIG
+        and isinstance(ops[0], int)
+        and isinstance(ops[-2], int)
+        and all(isinstance(k, bytes) and len(k) in (33, 65) for k in ops[1:-2])
+    ):
+        return [base58check(0x00, hash160(k)) for k in ops[1:-2]]
+    return ["nonstandard" + hashlib.sha256(script).hexdigest()]
+
+
+def read_varint(buf, pos):
+    n = buf[pos]
+    if n < 0xFD:
+        return n, pos + 1
+    if n == 0xFD:
+        return struct.unpack_from("<H", buf, pos + 1)[0], pos + 3
+    if n == 0xFE:
+        return struct.unpack_from("<I", buf, pos + 1)[0], pos + 5
+    return struct.unpack_from("<Q", buf, pos + 1)[0], pos + 9
+
+
+def parse_tx(buf, pos):
+    """Parse one transaction at ``pos``.
+
+    Returns ``(txid, inputs, outputs, end)`` where inputs are
+    ``(spent_txid, spent_index)`` and outputs ``(value, addresses)``.
+    """
+    start = pos
+    pos += 4
+    segwit = buf[pos] == 0 and buf[pos + 1] == 1
+    if segwit:
+        pos += 2
+    body = pos
+
+    count, pos = read_varint(buf, pos)
+    inputs = []
+    for _ in range(count):
+        spent = buf[pos : pos + 32][::-1].hex()
+        index = struct.unpack_from("<I", buf, pos + 32)[0]
+        size, pos = read_varint(buf, pos + 36)
+        pos += size + 4
+        inputs.append((spent, index))
+
+    count, pos = read_varint(buf, pos)
+    outputs = []
+    for _ in range(count):
+        value = struct.unpack_from("<q", buf, pos)[0]
+        size, pos = read_varint(buf, pos + 8)
+        outputs.append((value, script_addresses(buf[pos : pos + size])))
+        pos += size
+    end = pos
+
+    if segwit:
+        for _ in inputs:
+            items, pos = read_varint(buf, pos)
+            for _ in range(items):
+                size, pos = read_varint(buf, pos)
+                pos += size
+    pos += 4
+
+    if segwit:
+        raw = buf[start : start + 4] + buf[body:end] + buf[pos - 4 : pos]
+    else:
+        raw = buf[start:pos]
+    return dsha256(raw)[::-1].hex(), inputs, outputs, pos
+
+
+def parse_block(buf):
+    """Parse a serialized block into its header fields and transactions."""
+    header = buf[:80]
+    count, pos = read_varint(buf, 80)
+    txs = []
+    for _ in range(count):
+        txid, inputs, outputs, pos = parse_tx(buf, pos)
+        txs.append((txid, inputs, outputs))
+    return dsha256(header)[::-1].hex(), txs
+
+
+def read_blkfile(path, key=b"", offset=0, size=None):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read() if size is None else f.read(size)
+    if key.strip(b"\x00"):
+        # bitcoind 28+ obfuscates block files with the key in xor.dat
+        shift = offset % len(key)
+        stream = (key[shift:] + key * (len(data) // len(key) + 2))[: len(data)]
+        data = (
+            int.from_bytes(data, "big") ^ int.from_bytes(stream, "big")
+        ).to_bytes(len(data), "big")
+    return data
+
+
+def scan_headers(args):
+    """Return ``(hash, prev_hash, time, path, offset, size)`` for every
+    block stored in one blk file."""
+    path, key = args
+    data = read_blkfile(path, key)
+    headers = []
+    pos = 0
+    while pos + 88 <= len(data) and data[pos : pos + 4] == MAGIC:
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        start = pos + 8
+        if start + size > len(data):
+            # still being written by bitcoind
+            break
+        header = data[start : start + 80]
+        headers.append(
+            (
+                dsha256(header)[::-1].hex(),
+                header[4:36][::-1].hex(),
+                struct.unpack_from("<I", header, 68)[0],
+                str(path),
+                start,
+                size,
+            )
+        )
+        pos = start + size
+    return headers
+
+
+def load_block(args):
+    path, offset, size, key = args
+    return parse_block(read_blkfile(path, key, offset, size))
+
+
+def block_month(timestamp):
+    return timestamp.date().replace(day=1)
+
+
+class BlkFileReader(Source):
+    """Block and transaction rows parsed from local ``blk*.dat`` files.
+
+    Block files are scanned and parsed on a process pool of
+    ``pool_size`` workers.  Input values and addresses come from an in
+    memory map of unspent outputs built by replaying the chain from
+    genesis, so months must be read in order by a single process.
+
+    Block timestamps are not monotonic, so reading a month parses a few
+    blocks of the next month.  Their rows are kept until that month is
+    read.  Only asking for a block that was already read restarts the
+    replay.
+    """
+
+    parallel = False
+
+    def __init__(self, path, pool_size=1, chunksize=16):
+        self.path = Path(path)
+        self.pool_size = pool_size
+        self.chunksize = chunksize
+        # headers of each blk file by path, and the size they were read at
+        self.scanned = {}
+        self.reset()
+
+    def reset(self):
+        self.height = 0
+        self.utxos = {}
+        # rows of blocks read ahead of their month
+        self.parked = {}
+
+    @lazy
+    def key(self):
+        xor = self.path / "xor.dat"
+        return xor.read_bytes() if xor.exists() else b""
+
+    @lazy
+    def pool(self):
+        return Pool(self.pool_size)
+
+    def map(self, f, items):
+        if self.pool_size == 1:
+            return map(f, items)
+        return self.pool.imap(f, items, self.chunksize)
+
+    def scan(self):
+        """Read the headers of blk files that are new or have grown since
+        they were last read."""
+        sizes = {f: f.stat().st_size for f in sorted(self.path.glob("blk*.dat"))}
+        changed = [
+            f
+            for f, size in sizes.items()
+            if f not in self.scanned or self.scanned[f][0] != size
+        ]
+        scans = self.map(scan_headers, [(f, self.key) for f in changed])
+        for f, headers in zip(changed, scans):
+            self.scanned[f] = (sizes[f], headers)
+
+    @lazy
+    def headers(self):
+        """Headers of the best chain, in height order."""
+        self.scan()
+        children = {}
+        for _, headers in self.scanned.values():
+            for h in headers:
+                children.setdefault(h[1], []).append(h)
+
+        parents = {}
+        tip = None
+        level = children.get(NULL_HASH, [])
+        while level:
+            tip = level[0]
+            following = []
+            for h in level:
+                for c in children.get(h[0], []):
+                    parents[c[0]] = h
+                    following.append(c)
+            level = following
+
+        best = []
+        while tip is not None:
+            best.append(tip)
+            tip = parents.get(tip[0])
+        best.reverse()
+        return best
+
+    def blocks(self, after=None):
+        if after is not None:
+            # polling for new blocks, pick up what bitcoind wrote since
+            unload(self, "headers")
+        for number, h in enumerate(self.headers):
+            if after is not None and number <= after:
+                continue
+            timestamp = datetime.fromtimestamp(h[2], timezone.utc)
+            yield dict(
+                number=number,
+                hash=h[0],
+                timestamp=timestamp,
+                timestamp_month=block_month(timestamp),
+            )
+
+    def transactions(self, month, start=None, end=None):
+        """Rows for every transaction in ``month``, shaped like the
+        BigQuery transaction query."""
+        if isinstance(month, str):
+            month = date.fromisoformat(month)
+        months = [
+            block_month(datetime.fromtimestamp(h[2], timezone.utc))
+            for h in self.headers
+        ]
+        wanted = [
+            n
+            for n, m in enumerate(months)
+            if m == month
+            and (start is None or n >= start)
+            and (end is None or n <= end)
+        ]
+        if not wanted:
+            return
+        if any(n < self.height and n not in self.parked for n in wanted):
+            self.reset()
+
+        for number in wanted:
+            if number < self.height:
+                yield from self.parked.pop(number)
+
+        jobs = [
+            (h[3], h[4], h[5], self.key)
+            for h in self.headers[self.height : wanted[-1] + 1]
+        ]
+        blocks = self.map(load_block, jobs)
+        wanted = set(wanted)
+        for number, (bhash, txs) in enumerate(blocks, self.height):
+            rows = self.spend(number, bhash, txs)
+            self.height = number + 1
+            if number in wanted:
+                yield from rows
+            elif months[number] >= month:
+                self.parked[number] = rows
+
+    def spend(self, number, bhash, txs):
+        """Assign blocktime ids to a block's transactions, update the
+        unspent output map and return the block's rows."""
+        h = self.headers[number]
+        timestamp = datetime.fromtimestamp(h[2], timezone.utc)
+        base = dict(
+            b_number=number,
+            b_hash=bhash,
+            b_timestamp=timestamp,
+            b_timestamp_month=block_month(timestamp),
+        )
+        txs = sorted(txs)
+        t_ids = {}
+        for row, (txid, _, outputs) in enumerate(txs, 1):
+            t_id = (number << 32) + (row << 16)
+            t_ids[txid] = t_id
+            for index, (value, addresses) in enumerate(outputs):
+                self.utxos[(txid, index)] = (t_id, value, addresses)
+
+        rows = []
+        for txid, inputs, outputs in txs:
+            spents = []
+            for index, (spent, spent_index) in enumerate(inputs):
+                if spent == NULL_HASH and spent_index == COINBASE_INDEX:
+                    spents.append(
+                        dict(
+                            i_spent_tid=None,
+                            i_spent_index=None,
+                            i_addresses=[],
+                            i_value=None,
+                            i_index=None,
+                        )
+                    )
+                    continue
+                spent_tid, value, addresses = self.utxos.pop((spent, spent_index))
+                spents.append(
+                    dict(
+                        i_spent_tid=spent_tid,
+                        i_spent_index=spent_index,
+                        i_addresses=addresses,
+                        i_value=value,
+                        i_index=index,
+                    )
+                )
+            for i in spents:
+                for index, (value, addresses) in enumerate(outputs):
+                    rows.append(
+                        dict(
+                            base,
+                            t_id=t_ids[txid],
+                            t_hash=txid,
+                            o_index=index,
+                            o_addresses=addresses,
+                            o_value=value,
+                            **i,
+                        )
+                    )
+        return rows
@@ -1,37 +1,69 @@
 from collections import defaultdict
-from itertools import chain
 from pathlib import Path
 from psycopg2.extras import execute_values
 
-from pygraphblas import UINT64, Matrix
+from pygraphblas import UINT64, Matrix, binaryop
 
+from coinblas.metrics import metrics
 from coinblas.util import (
     curse,
     get_block_number,
     get_tx_id,
-    query,
     maximal_matrix,
+    build_matrix,
     lazy,
     btc,
 )
 
+SUFFIXES = ("BT", "IT", "TO", "SI", "OR", "ST", "TR")
 
-class Block:
-    def __init__(self, chain, number, hash=None):
-        self.chain = chain
-        self.id = number << 32
-        self.number = number
-        if hash is not None:
-            self.hash = hash
-        self.pending_txs = {}
+
+class BlockGraph:
+    """Incidence matrices stored as one ``.ssb`` file per suffix.
+
+    Subclasses provide ``datafile(suffix, path=None)`` and ``span``, the
+    first and last block numbers the matrices cover.
+    """
 
     def load_block_graph(self, suffix):
-        bhash = self.hash
-        prefix = self.chain.block_path / bhash[-2] / bhash[-1]
-        datafile = prefix / f"{self.number}_{bhash}_{suffix}.ssb"
+        datafile = self.datafile(suffix)
         if not datafile.exists():
             return maximal_matrix(UINT64)
-        return Matrix.from_binfile(bytes(datafile))
+        with metrics.span("load_block_graph"):
+            metrics.count("load.matrices")
+            metrics.count("load.bytes", datafile.stat().st_size)
+            return Matrix.from_binfile(bytes(datafile))
+
+    def load_block_graphs(self, suffixes=SUFFIXES):
+        """Read several matrices in one pass without caching them.
+
+        Returns a dict of suffix to matrix and the number of bytes read.
+        """
+        graphs = {}
+        nbytes = 0
+        with metrics.span("load_block_graphs"):
+            for suffix in suffixes:
+                datafile = self.datafile(suffix)
+                try:
+                    nbytes += datafile.stat().st_size
+                except FileNotFoundError:
+                    graphs[suffix] = maximal_matrix(UINT64)
+                    continue
+                graphs[suffix] = Matrix.from_binfile(bytes(datafile))
+                metrics.count("load.matrices")
+        metrics.count("load.bytes", nbytes)
+        return graphs, nbytes
+
+    def write_block_files(self, path=None):
+        with metrics.span("write_block_files"):
+            for suffix in SUFFIXES:
+                datafile = self.datafile(suffix, path)
+                datafile.parent.mkdir(parents=True, exist_ok=True)
+                matrix = getattr(self, suffix)
+                matrix.to_binfile(bytes(datafile))
+                metrics.count("write.matrices")
+                metrics.count("write.nvals", matrix.nvals)
+                metrics.count("write.bytes", datafile.stat().st_size)
 
     @lazy
     def BT(self):
@@ -68,23 +100,32 @@ class Block:
         """ Incidence Matrix from Output id rows to Receiver Address id columns. """
         return self.load_block_graph("TR")
 
+
+class Block(BlockGraph):
+    def __init__(self, chain, number, hash=None):
+        self.chain = chain
+        self.id = number << 32
+        self.number = number
+        if hash is not None:
+            self.hash = hash
+        self.pending_txs = {}
+
+    @property
+    def span(self):
+        return self.number, self.number
+
+    def datafile(self, suffix, path=None):
+        path = Path(path or self.chain.block_path)
+        bhash = self.hash
+        return path / bhash[-2] / bhash[-1] / f"{self.number}_{bhash}_{suffix}.ssb"
+
     @lazy
-    @curse
-    @query
-    def hash(self, curs):
-        """
-        SELECT b_hash FROM bitcoin.base_block WHERE b_number = {self.number}
-        """
-        return curs.fetchone()[0]
+    def hash(self):
+        return self.chain.resolver.get("block", self.number)[0]
 
     @lazy
-    @curse
-    @query
-    def timestamp(self, curs):
-        """
-        SELECT b_timestamp FROM bitcoin.base_block WHERE b_number = {self.number}
-        """
-        return curs.fetchone()[0]
+    def timestamp(self):
+        return self.chain.resolver.get("block", self.number)[1]
 
     @lazy
     def tx_vector(self):
@@ -92,124 +133,114 @@ class Block:
 
     @curse
     def finalize(self, curs, month):
-        month = str(month).replace("-", "_")
+        self.build_graphs(curs)
+        self.write_block_files(self.chain.block_path)
+        self.write_rows(curs, month)
+        self.pending_txs.clear()
+
+    def build_graphs(self, curs):
+        """Build the block's matrices from its pending txs, resolving
+        address ids through ``curs``."""
         i_addrs = defaultdict(list)
         o_addrs = defaultdict(list)
+        IT = ([], [], [])
+        TO = ([], [], [])
+        BT = ([], [], [])
 
         for t_id, tx in self.pending_txs.items():
             for i, v in tx.pending_inputs.items():
-                self.IT[i, t_id] = v
+                IT[0].append(i)
+                IT[1].append(t_id)
+                IT[2].append(v)
 
             for o, v in tx.pending_outputs.items():
-                self.TO[t_id, o] = v
-                blockout = self.BT.get(self.id, t_id, 0)
-                self.BT[self.id, t_id] = blockout + v
+                TO[0].append(t_id)
+                TO[1].append(o)
+                TO[2].append(v)
+                BT[0].append(self.id)
+                BT[1].append(t_id)
+                BT[2].append(v)
 
             for a, i in tx.pending_input_addresses.items():
                 i_addrs[a] += i
             for a, o in tx.pending_output_addresses.items():
                 o_addrs[a] += o
 
-        to_insert = [(i,) for i in chain(i_addrs.keys(), o_addrs.keys())]
-
-        curs.connection.commit()
-        execute_values(
-            curs,
-            f"""
-            INSERT INTO bitcoin.address (a_address)
-            VALUES %s ORDER BY 1
-            ON CONFLICT DO NOTHING
-            """,
-            to_insert,
-            page_size=10000,
-        )
-        curs.connection.commit()
-
-        curs.execute(
-            """
-            SELECT a_address, a_id from bitcoin.address where a_address = any(%s)
-            """,
-            (list(i_addrs.keys()),),
-        )
-        i_ids = dict(curs.fetchall())
-
-        assert len(i_ids) == len(i_addrs)
-
-        sas = defaultdict(int)
-        for a_address, inputs in i_addrs.items():
-            a_id = i_ids[a_address]
-            for (t_id, i_id, i_value) in inputs:
-                self.SI[a_id, i_id] = i_value
-                sas[(a_id, t_id)] += i_value
-
-        for (a_id, t_id), i_value in sas.items():
-            self.ST[a_id, t_id] = i_value
-
-        curs.execute(
-            """
-            SELECT a_address, a_id from bitcoin.address where a_address = any(%s)
-            """,
-            (list(o_addrs.keys()),),
-        )
-        o_ids = dict(curs.fetchall())
+        self.IT = build_matrix(UINT64, *IT)
+        self.TO = build_matrix(UINT64, *TO)
+        self.BT = build_matrix(UINT64, *BT, dup_op=binaryop.PLUS)
 
-        assert len(o_ids) == len(o_addrs)
+        self.new_addresses = {}
+        with metrics.span("sql.resolve_addresses"):
+            a_ids = self.chain.resolve_addresses(
+                curs, set(i_addrs) | set(o_addrs), self.new_addresses
+            )
 
-        ras = defaultdict(int)
+        SI = ([], [], [])
+        ST = ([], [], [])
+        for a_address, inputs in i_addrs.items():
+            a_id = a_ids[a_address]
+            for (t_id, i_id, i_value) in inputs:
+                SI[0].append(a_id)
+                SI[1].append(i_id)
+                SI[2].append(i_value)
+                ST[0].append(a_id)
+                ST[1].append(t_id)
+                ST[2].append(i_value)
+
+        self.SI = build_matrix(UINT64, *SI)
+        self.ST = build_matrix(UINT64, *ST, dup_op=binaryop.PLUS)
+
+        OR = ([], [], [])
+        TR = ([], [], [])
         for a_address, outputs in o_addrs.items():
-            a_id = o_ids[a_address]
+            a_id = a_ids[a_address]
             for (t_id, o_id, o_value) in outputs:
-                self.OR[o_id, a_id] = o_value
-                ras[(a_id, t_id)] += o_value
-
-        for (a_id, t_id), o_value in ras.items():
-            self.TR[t_id, a_id] = o_value
-
-        execute_values(
-            curs,
-            f"""
-            INSERT INTO bitcoin."base_tx_{month}" (t_id, t_hash) VALUES %s ORDER BY 1
-            """,
-            [(t.id, t.hash) for t in self.pending_txs.values()],
-            page_size=10000,
-        )
-        curs.connection.commit()
-
-        execute_values(
-            curs,
-            f"""
-        UPDATE bitcoin.base_block
-            SET b_addresses = s.agg,
-                b_imported_at = now()
-            FROM (SELECT hll_add_agg(hll_hash_bigint(v.id)) as agg
-                  FROM (VALUES %s) v(id)) s
-        WHERE b_number = {self.number}
-            """,
-            [(a,) for a in o_ids.values()],
-            page_size=10000,
-        )
-        self.write_block_files(self.chain.block_path)
+                OR[0].append(o_id)
+                OR[1].append(a_id)
+                OR[2].append(o_value)
+                TR[0].append(t_id)
+                TR[1].append(a_id)
+                TR[2].append(o_value)
 
-        self.pending_txs.clear()
+        self.OR = build_matrix(UINT64, *OR)
+        self.TR = build_matrix(UINT64, *TR, dup_op=binaryop.PLUS)
 
-    def write_block_files(self, path):
-        b = Path(path) / Path(self.hash[-2]) / Path(self.hash[-1])
-        b.mkdir(parents=True, exist_ok=True)
-        BTf = b / Path(f"{self.number}_{self.hash}_BT.ssb")
-        ITf = b / Path(f"{self.number}_{self.hash}_IT.ssb")
-        TOf = b / Path(f"{self.number}_{self.hash}_TO.ssb")
-        SIf = b / Path(f"{self.number}_{self.hash}_SI.ssb")
-        ORf = b / Path(f"{self.number}_{self.hash}_OR.ssb")
-        STf = b / Path(f"{self.number}_{self.hash}_ST.ssb")
-        TRf = b / Path(f"{self.number}_{self.hash}_TR.ssb")
-
-        self.BT.to_binfile(bytes(BTf))
-        self.IT.to_binfile(bytes(ITf))
-        self.TO.to_binfile(bytes(TOf))
-        self.SI.to_binfile(bytes(SIf))
-        self.OR.to_binfile(bytes(ORf))
-        self.ST.to_binfile(bytes(STf))
-        self.TR.to_binfile(bytes(TRf))
+        self.receivers = [a_ids[a] for a in o_addrs]
+
+    def write_rows(self, curs, month):
+        """Write the block's tx rows and mark it imported."""
+        month = str(month).replace("-", "_")
+        tx_rows = self.tx_rows = [(t.id, t.hash) for t in self.pending_txs.values()]
+        receivers = self.receivers
+
+        if self.chain.bulk:
+            self.chain.buffer_block(self.number, month, tx_rows, receivers)
+            return
+        with metrics.span("sql.insert_tx"):
+            execute_values(
+                curs,
+                f"""
+                INSERT INTO bitcoin."base_tx_{month}" (t_id, t_hash) VALUES %s ORDER BY 1
+                """,
+                tx_rows,
+                page_size=10000,
+            )
+
+        with metrics.span("sql.update_block"):
+            execute_values(
+                curs,
+                f"""
+            UPDATE bitcoin.base_block
+                SET b_addresses = s.agg,
+                    b_imported_at = now()
+                FROM (SELECT hll_add_agg(hll_hash_bigint(v.id)) as agg
+                      FROM (VALUES %s) v(id)) s
+            WHERE b_number = {self.number}
+                """,
+                [(a,) for a in receivers],
+                page_size=10000,
+            )
 
     def __len__(self):
         return self.tx_vector.nvals
@@ -217,7 +248,9 @@ class Block:
     def __iter__(self):
         from .tx import Tx
 
-        for t_id, _ in self.tx_vector:
+        txs = list(self.tx_vector)
+        self.chain.resolver.want("tx", (t_id for t_id, _ in txs))
+        for t_id, _ in txs:
             yield Tx(self.chain, id=t_id)
 
     def __repr__(self):
@@ -4,13 +4,16 @@ from itertools import repeat, groupby
 from time import time
 from functools import reduce
 from operator import itemgetter, add
-from collections import OrderedDict
+from collections import Counter, OrderedDict, deque
+from threading import Event, Thread
 import logging
+import math
+import shutil
 
+import numpy as np
 import psycopg2 as pg
 from psycopg2.extras import execute_values
 from tenacity import retry, stop_after_attempt
-from google.cloud import bigquery
 
 from pygraphblas import (
     Matrix,
@@ -18,67 +21,259 @@ from pygraphblas import (
     semiring,
     binaryop,
     unaryop,
+    descriptor,
+    lib,
+    INT64,
     UINT64,
 )
 
+from coinblas.metrics import metrics, Progress
 from coinblas.util import (
     btc,
+    block_range,
+    build_matrix,
+    copy_rows,
     curse,
+    CopyBuffer,
     grouper,
+    pipeline,
+    present,
     query,
     maximal_matrix,
     lazy,
+    loaded,
+    LRUCache,
+    MatrixCache,
+    cached,
+    difference,
+    drop_range,
+    select_ids,
+    select_range,
+    unload,
     Object,
 )
 
-from .block import Block
+from .block import Block, SUFFIXES
+from .rollup import Rollup
+from .entity import Entities
+from .compact import Compact
+from .flow import Flow
+from .resolver import Resolver
+from .iddict import IdDict
+from .source import BigQuerySource, RecordSource, ReplaySource, recording
 from .tx import Tx
 from .address import Address
 
 POOL_SIZE = 8
+ADDRESS_CACHE_SIZE = 1 << 20
+BULK_FLUSH_ROWS = 1 << 20
+QUEUE_SIZE = 8
+POLL_INTERVAL = 60
+BFS_BUDGET = 1 << 30
+SHARD_BLOCKS = 256
+IDDICT_SEGMENTS = 64
+
+# the axis of each base matrix indexed by the blocks' own tx or output ids
+TX_AXES = dict(BT=0, IT=1, TO=0, OR=0, ST=1, TR=0)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# the chain of an import worker process, see Chain.import_shards
+_worker = None
+
+
+def init_worker(chain, source=None):
+    global _worker
+    _worker = chain
+    if source is not None:
+        _worker.source = source
+
+
+def import_shard(shard):
+    # a worker's metrics are reset for every shard and sent back with
+    # its stats for the coordinator to merge
+    metrics.reset()
+    stats = _worker.import_shard(*shard)
+    stats["metrics"] = metrics.snapshot()
+    return stats
+
 
 class Chain:
-    def __init__(self, dsn, block_path, pool_size=POOL_SIZE, logger=logger):
+    def __init__(
+        self,
+        dsn,
+        block_path,
+        pool_size=POOL_SIZE,
+        logger=logger,
+        address_cache_size=ADDRESS_CACHE_SIZE,
+        bulk=False,
+        flush_rows=BULK_FLUSH_ROWS,
+        queue_size=QUEUE_SIZE,
+        source=None,
+        matrix_budget=None,
+    ):
         self.chain = self
         self.dsn = dsn
         self.block_path = Path(block_path)
         self.pool_size = pool_size
         self.logger = logger
+        self.address_cache_size = address_cache_size
+        self.bulk = bulk
+        self.flush_rows = flush_rows
+        self.queue_size = queue_size
+        self.source = source or BigQuerySource()
+        self.matrix_budget = matrix_budget
 
     @lazy
     def blocks(self):
         return OrderedDict()
 
-    def merge_block_graphs(self, suffix, op=binaryop.SECOND):
-        self.logger.debug(f"Merging {len(self.blocks)} {suffix} blocks.")
-        blocks = list(grouper(zip(self.blocks.values(), repeat(suffix)), 2, None))
+    @property
+    def rollups(self):
+        """All rollups on disk, largest first."""
+        rollups = [
+            Rollup.from_datafile(self, datafile)
+            for datafile in (self.block_path / "rollup").glob("*_BT.ssb")
+        ]
+        return sorted(rollups, key=len, reverse=True)
+
+    def spans(self):
+        """Cover the loaded blocks with the coarsest rollups available.
+
+        Blocks at the edges of the loaded range that no rollup covers
+        are returned as themselves.
+        """
+        chosen = []
+        for rollup in self.rollups:
+            first, last = rollup.span
+            if first not in self.blocks or last not in self.blocks:
+                continue
+            if any(first <= c.last and c.first <= last for c in chosen):
+                continue
+            chosen.append(rollup)
+        covered = set()
+        for rollup in chosen:
+            covered.update(range(rollup.first, rollup.last + 1))
+        spans = chosen + [b for n, b in self.blocks.items() if n not in covered]
+        return sorted(spans, key=lambda s: s.span)
+
+    def merge_block_graphs(self, suffix, op=binaryop.SECOND, blocks=None):
+        if blocks is None:
+            blocks = self.spans()
+        self.logger.debug(f"Merging {len(blocks)} {suffix} blocks.")
+        blocks = list(grouper(zip(blocks, repeat(suffix)), 2, None))
+        level = 0
         with op:
             while len(blocks) > 1:
-                blocks = list(
-                    grouper(self.mapper(self.merge_block_pairs, blocks), 2, None)
-                )
-            return self.merge_block_pairs(blocks[0])
+                with metrics.span(f"merge_block_graphs.{suffix}.level{level}"):
+                    blocks = list(
+                        grouper(self.mapper(self.merge_block_pairs, blocks), 2, None)
+                    )
+                level += 1
+            with metrics.span(f"merge_block_graphs.{suffix}.level{level}"):
+                return self.merge_block_pairs(blocks[0])
+
+    @lazy
+    def thread_pool(self):
+        return ThreadPool(self.pool_size)
 
     @lazy
     def mapper(self):
         if self.pool_size == 1:
             return lambda f, s: list(map(f, s))
         else:
-            thread_pool = ThreadPool(self.pool_size)
-            return lambda f, s: thread_pool.map(f, s, 1)
+            return lambda f, s: self.thread_pool.map(f, s, 1)
+
+    def load_graphs(self, suffixes=SUFFIXES, window=None):
+        """Load and merge several matrices in a single pass over the blocks."""
+        tic = time()
+        spans = self.spans()
+        with metrics.span("load_graphs"):
+            merged, nblocks, nbytes = self.read_graphs(spans, suffixes, window)
+        for suffix in suffixes:
+            setattr(self, suffix, merged[suffix])
+
+        took = max(time() - tic, 1e-9)
+        self.load_stats = dict(
+            blocks=nblocks, spans=len(spans), bytes=nbytes, seconds=took
+        )
+        self.logger.info(
+            f"Loaded {nblocks} blocks from {len(spans)} spans, "
+            f"{nbytes / 1e6:.1f} MB in {took:.2f}s: "
+            f"{nblocks / took:.0f} blocks/s, {nbytes / 1e6 / took:.1f} MB/s"
+        )
+        return self.load_stats
+
+    def load_base(self, suffix):
+        """The base matrix ``suffix``, read in the same single pass over
+        the spans as every other base matrix that is not loaded yet."""
+        suffixes = [s for s in SUFFIXES if s != suffix and not loaded(self, s)]
+        # the asked for matrix is stored last so it is not the one a
+        # matrix budget evicts
+        self.load_graphs(suffixes + [suffix])
+        return getattr(self, suffix)
+
+    def read_graphs(self, spans, suffixes=SUFFIXES, window=None):
+        """Read and merge the ``suffixes`` matrices of ``spans``.
+
+        Spans are read on the thread pool with all of ``suffixes`` read
+        together, at most ``window`` spans in flight at once.  Loaded
+        spans are merged as they arrive, partial merges are kept on a
+        binary carry stack so only a logarithmic number of unmerged
+        matrices are ever resident.  Returns the merged matrices by
+        suffix, the number of blocks and the number of bytes read.
+        """
+        window = window or 2 * self.pool_size
+        pending = deque()
+        stack = []
+        nblocks = nbytes = 0
+
+        def merge(left, right):
+            return {s: self.merge_block_pairs((left[s], right[s])) for s in suffixes}
+
+        def push(graphs):
+            level = 0
+            while stack and stack[-1][0] == level:
+                graphs = merge(stack.pop()[1], graphs)
+                level += 1
+            stack.append((level, graphs))
+
+        def drain():
+            nonlocal nbytes
+            graphs, size = pending.popleft().get()
+            nbytes += size
+            push(graphs)
+
+        for span in spans:
+            if len(pending) >= window:
+                drain()
+            pending.append(
+                self.thread_pool.apply_async(span.load_block_graphs, (suffixes,))
+            )
+            first, last = span.span
+            nblocks += last - first + 1
+        while pending:
+            drain()
+
+        merged = {}
+        while stack:
+            graphs = stack.pop()[1]
+            merged = merge(graphs, merged) if merged else graphs
+        merged = {s: merged.get(s, maximal_matrix(UINT64)) for s in suffixes}
+        return merged, nblocks, nbytes
 
     def merge_block_pairs(self, pair):
         left, right = pair
+        # blocks only need their own matrices until they are merged
         if isinstance(left, tuple):
             lblock, ls = left
             left = getattr(lblock, ls)
+            unload(lblock, ls)
         if isinstance(right, tuple):
             rblock, rs = right
             right = getattr(rblock, rs)
+            unload(rblock, rs)
         if left is None:
             return right
         if right is None:
@@ -90,50 +285,433 @@ class Chain:
         return pg.connect(self.dsn)
 
     @lazy
+    def build_conn(self):
+        """The connection the build stage of ``import_blocks`` resolves
+        addresses on, concurrently with ``conn``."""
+        return pg.connect(self.dsn)
+
+    def __getstate__(self):
+        """Pickle only the configuration.  Connections, pools, caches and
+        loaded matrices are all lazy properties, kept as ``_name``, and
+        a copy opens or computes its own on first use."""
+        return {k: v for k, v in vars(self).items() if not k.startswith("_")}
+
+    @cached
     def BT(self):
-        return self.merge_block_graphs("BT")
+        return self.load_base("BT")
 
-    @lazy
+    @cached
     def IT(self):
-        return self.merge_block_graphs("IT")
+        return self.load_base("IT")
 
-    @lazy
+    @cached
     def TO(self):
-        return self.merge_block_graphs("TO")
+        return self.load_base("TO")
 
-    @lazy
+    @cached
     def SI(self):
-        return self.merge_block_graphs("SI")
+        return self.load_base("SI")
 
-    @lazy
+    @cached
     def OR(self):
-        return self.merge_block_graphs("OR")
+        return self.load_base("OR")
 
-    @lazy
+    @cached
     def ST(self):
-        return self.merge_block_graphs("ST")
+        return self.load_base("ST")
 
-    @lazy
+    @cached
     def TR(self):
-        return self.merge_block_graphs("TR")
+        return self.load_base("TR")
 
-    @lazy
+    @cached
     def IO(self):
-        with semiring.PLUS_MIN:
-            return self.IT @ self.TO
+        with metrics.span("product.IO"), semiring.PLUS_MIN:
+            IO = self.IT @ self.TO
+        metrics.count("nvals.IO", IO.nvals)
+        return IO
 
-    @lazy
+    @cached
     def SR(self):
-        with semiring.PLUS_MIN:
-            return self.ST @ self.TR
+        with metrics.span("product.SR"), semiring.PLUS_MIN:
+            SR = self.ST @ self.TR
+        metrics.count("nvals.SR", SR.nvals)
+        return SR
 
-    @lazy
+    @cached
     def TT(self):
-        with semiring.PLUS_PLUS:
-            return self.IT.T @ self.TO.T
+        with metrics.span("product.TT"), semiring.PLUS_PLUS:
+            TT = self.IT.T @ self.TO.T
+        metrics.count("nvals.TT", TT.nvals)
+        return TT
+
+    @lazy
+    def resolver(self):
+        return Resolver(self)
+
+    @lazy
+    def matrix_cache(self):
+        """The merged and derived matrices of the chain, the least
+        recently used are dropped beyond ``matrix_budget`` bytes and are
+        loaded or computed again when next used."""
+        return MatrixCache(self.matrix_budget)
+
+    @cached
+    def IT_T(self):
+        """IT transposed, for extracting the inputs of a tx as a row."""
+        return self.IT.transpose()
+
+    @cached
+    def SI_T(self):
+        """SI transposed, for extracting the senders of an input as a row."""
+        return self.SI.transpose()
+
+    @cached
+    def OR_T(self):
+        """OR transposed, for extracting the outputs to an address as a row."""
+        return self.OR.transpose()
+
+    @cached
+    def TR_T(self):
+        """TR transposed, for extracting the txs to an address as a row."""
+        return self.TR.transpose()
+
+    def compact(self):
+        """A snapshot of the loaded chain renumbered to contiguous
+        indices, see ``Compact``."""
+        return Compact(self)
+
+    def flow(self, model="haircut"):
+        """A taint tracer over the loaded chain, see ``Flow``."""
+        return Flow(self, model)
+
+    @lazy
+    def entities(self):
+        """Addresses clustered by common input ownership."""
+        return Entities(self)
+
+    @cached
+    def SR_T(self):
+        """SR transposed, for pulling traversals backwards along SR."""
+        return self.SR.transpose()
+
+    @lazy
+    def SR_receivers(self):
+        """The number of addresses that receive along SR.  Reduced from
+        SR so that only traversals that pull build ``SR_T``."""
+        return self.SR.reduce_vector(desc=descriptor.T0).nvals
+
+    def bfs_chunk_size(self, depth, budget):
+        """Estimate how many BFS sources fit in ``budget`` bytes.
+
+        Each source keeps a frontier and a result row that can grow to
+        every address it reaches, bounded by the number of receiving
+        addresses in SR or the mean out degree raised to ``depth``.
+        Entries cost 16 bytes and there are around three copies in
+        flight during a masked ``mxm``.
+        """
+        SR = self.SR
+        senders = SR.reduce_vector().nvals
+        receivers = self.SR_receivers
+        degree = SR.nvals / max(senders, 1)
+        reach = max(receivers, 1)
+        # compared in log space, the power overflows a float for high
+        # degrees long before it stops growing
+        levels = min(depth + 1, 64)
+        if levels * math.log(degree + 1) < math.log(reach):
+            reach = (degree + 1) ** levels
+        return max(1, int(budget // (48 * max(reach, 1))))
+
+    def multi_bfs(self, sources, start, step, update, depth, budget, chunk_size):
+        """Traverse SR from many ``sources`` at once.
+
+        The frontier is a matrix with one row per source, seeded with
+        ``start(source)`` on the diagonal, and is advanced a level at a
+        time with ``mxm`` over the ``step`` semiring, masked by the
+        complement of the addresses each source has already reached.
+        ``update(result, frontier, level)`` records the new frontier.
+        Sources are traversed ``chunk_size`` at a time, estimated from
+        ``budget`` when not given.  Returns a matrix of sources by
+        reached addresses.
+        """
+        SR = self.SR
+        ids = sorted({getattr(s, "id", s) for s in sources})
+        if chunk_size is None:
+            chunk_size = self.bfs_chunk_size(depth, budget)
+        result = maximal_matrix(INT64)
+        for chunk in grouper(ids, chunk_size):
+            chunk = [i for i in chunk if i is not None]
+            q = build_matrix(INT64, chunk, chunk, [start(i) for i in chunk])
+            pi = maximal_matrix(INT64)
+            for level in range(min(depth + 1, SR.nvals)):
+                with step:
+                    q.mxm(SR, out=q, mask=pi, desc=descriptor.RSC)
+                if not q.nvals:
+                    break
+                update(pi, q, level)
+            result.eadd(pi, binaryop.SECOND, out=result)
+        self.logger.debug(
+            f"Traversed {len(ids)} sources in chunks of {chunk_size}, "
+            f"reached {result.nvals}"
+        )
+        return result
+
+    def bfs_levels(
+        self, sources, depth=lib.GxB_INDEX_MAX, budget=BFS_BUDGET, chunk_size=None
+    ):
+        """Batched ``Address.bfs_level``, rows are source address ids."""
+
+        def update(pi, q, level):
+            pi.assign_scalar(level + 1, mask=q, desc=descriptor.S)
+
+        return self.multi_bfs(
+            sources,
+            lambda i: 0,
+            semiring.ANY_PAIR_INT64,
+            update,
+            depth,
+            budget,
+            chunk_size,
+        )
+
+    def bfs_parents(
+        self, sources, depth=lib.GxB_INDEX_MAX, budget=BFS_BUDGET, chunk_size=None
+    ):
+        """Batched ``Address.bfs_parent``, rows are source address ids."""
+
+        def update(pi, q, level):
+            pi.assign(q, mask=q, desc=descriptor.S)
+
+        return self.multi_bfs(
+            sources,
+            lambda i: i,
+            semiring.ANY_SECONDI_INT64,
+            update,
+            depth,
+            budget,
+            chunk_size,
+        )
+
+    def bfs_exposures(
+        self, sources, depth=lib.GxB_INDEX_MAX, budget=BFS_BUDGET, chunk_size=None
+    ):
+        """Batched ``Address.bfs_exposure``, rows are source address ids."""
+
+        def update(pi, q, level):
+            pi.assign(q, mask=q, desc=descriptor.S)
+
+        return self.multi_bfs(
+            sources,
+            lambda i: lib.GxB_INDEX_MAX,
+            semiring.MIN_MIN_INT64,
+            update,
+            depth,
+            budget,
+            chunk_size,
+        )
+
+    def append_blocks(self, blocks):
+        """Add newly imported ``blocks`` to the loaded chain.
+
+        The base matrices and any derived adjacency that has already
+        been computed are updated in place of being recomputed.  Ids are
+        blocktime ordered, so appended txs only add new columns to IT
+        and ST and new rows to TO and TR, and the cross products of old
+        and new edges are empty.  The derived adjacencies therefore only
+        need products involving the new blocks:
+
+            IO' = IO + dIT @ dTO
+            SR' = SR + dST @ dTR
+            TT' = TT + dIT.T @ TO'.T
+
+        Blocks must be newer than every block already loaded.  All new
+        matrices are computed before any is assigned so readers see
+        either the old chain or the new one.
+        """
+        blocks = [b for b in blocks if b.number not in self.blocks]
+        if not blocks:
+            return
+        blocks.sort(key=lambda b: b.number)
+        if self.blocks and blocks[0].number < max(self.blocks):
+            raise ValueError(
+                f"Block {blocks[0].number} is older than the loaded chain."
+            )
+        tic = time()
+        delta, nblocks, nbytes = self.read_graphs(blocks)
+        # the delta holds the blocks' matrices from here on
+        for block in blocks:
+            for suffix in SUFFIXES:
+                unload(block, suffix)
+
+        updated = {}
+        for suffix in SUFFIXES:
+            if loaded(self, suffix):
+                updated[suffix] = getattr(self, suffix).eadd(
+                    delta[suffix], binaryop.SECOND
+                )
+        if loaded(self, "IO"):
+            with semiring.PLUS_MIN:
+                dIO = delta["IT"] @ delta["TO"]
+            updated["IO"] = self.IO.eadd(dIO, binaryop.PLUS)
+        if loaded(self, "SR"):
+            with semiring.PLUS_MIN:
+                dSR = delta["ST"] @ delta["TR"]
+            updated["SR"] = self.SR.eadd(dSR, binaryop.PLUS)
+            if loaded(self, "SR_T"):
+                updated["SR_T"] = self.SR_T.eadd(dSR.transpose(), binaryop.PLUS)
+        if loaded(self, "TT"):
+            TO = updated.get("TO")
+            if TO is None:
+                TO = self.merge_block_graphs("TO", blocks=self.spans() + blocks)
+                updated["TO"] = TO
+            with semiring.PLUS_PLUS:
+                dTT = delta["IT"].T @ TO.T
+            updated["TT"] = self.TT.eadd(dTT, binaryop.PLUS)
+
+        for block in blocks:
+            self.blocks[block.number] = block
+        for name, matrix in updated.items():
+            setattr(self, name, matrix)
+        unload(self, "SR_receivers")
+        for name in ("IT_T", "SI_T", "OR_T", "TR_T"):
+            unload(self, name)
+        if loaded(self, "entities"):
+            self.entities.append(delta["ST"], delta["TR"])
+        self.logger.info(
+            f"Appended {nblocks} blocks, {nbytes / 1e6:.1f} MB "
+            f"in {time() - tic:.2f}s, updated {', '.join(updated) or 'nothing'}."
+        )
+
+    def append_blockspan(self, start, end):
+        """Append the imported blocks ``start`` to ``end`` inclusive."""
+        self.append_blocks(self.blockspan(start, end))
+
+    @curse
+    @query
+    def blockspan(self, curs):
+        """
+        SELECT b_number, b_hash
+        FROM bitcoin.block
+        WHERE b_number <@ int4range(%s, %s + 1)
+        ORDER BY b_number
+        """
+        return [Block(self, b[0], b[1]) for b in curs.fetchall()]
+
+    def drop_blocks(self, first, last):
+        """Remove the blocks ``first`` to ``last`` inclusive from the
+        loaded chain.
+
+        Block numbers are the high bits of every tx and output id, so
+        the blocks are one id range ``[lo, hi)`` and their entries are
+        dropped by range from the tx side of each base matrix: the rows
+        of BT, TO, TR and OR and the columns of IT and ST.  SI is keyed
+        by the outputs the dropped txs spent, which are the rows of the
+        dropped IT columns.  Derived adjacencies that have already been
+        computed are pruned the same way:
+
+            IO' = IO without the output columns in range
+            TT' = TT without the tx rows and columns in range
+            SR' = SR with the rows of senders in range recomputed
+                  as ST'[senders] @ TR'
+
+        As in ``append_blocks`` every matrix is computed before any is
+        assigned.
+        """
+        dropped = [n for n in self.blocks if first <= n <= last]
+        if not dropped:
+            return
+        tic = time()
+        lo, hi = block_range(first, last)
+
+        updated = {}
+        for suffix, axis in TX_AXES.items():
+            if loaded(self, suffix):
+                updated[suffix] = drop_range(getattr(self, suffix), lo, hi, axis)
+        if loaded(self, "SI"):
+            spent = present(select_range(self.IT, lo, hi, 1))
+            updated["SI"] = difference(self.SI, select_ids(self.SI, spent, 1))
+        if loaded(self, "IO"):
+            updated["IO"] = drop_range(self.IO, lo, hi, 1)
+        if loaded(self, "TT"):
+            updated["TT"] = drop_range(drop_range(self.TT, lo, hi, 0), lo, hi, 1)
+        if loaded(self, "SR"):
+            senders = present(select_range(self.ST, lo, hi, 1))
+            ST = updated.get("ST")
+            if ST is None:
+                ST = drop_range(self.ST, lo, hi, 1)
+            TR = updated.get("TR")
+            if TR is None:
+                TR = drop_range(self.TR, lo, hi, 0)
+            with semiring.PLUS_MIN:
+                dSR = select_ids(ST, senders) @ TR
+            SR = difference(self.SR, select_ids(self.SR, senders))
+            updated["SR"] = SR.eadd(dSR, binaryop.PLUS)
+
+        for number in dropped:
+            del self.blocks[number]
+        for name, matrix in updated.items():
+            setattr(self, name, matrix)
+        unload(self, "SR_receivers")
+        unload(self, "entities")
+        for name in ("SR_T", "IT_T", "SI_T", "OR_T", "TR_T"):
+            unload(self, name)
+        self.logger.info(
+            f"Dropped {len(dropped)} blocks in {time() - tic:.2f}s, "
+            f"updated {', '.join(updated) or 'nothing'}."
+        )
+
+    def slide_blockspan(self, start, end):
+        """Move the loaded window to the blocks ``start`` to ``end``
+        inclusive, dropping the loaded blocks before ``start`` and
+        appending the imported ones after the last loaded block.  The
+        cost is that of the blocks entering and leaving the window, not
+        of the whole window.  Windows only move forward.
+        """
+        if self.blocks:
+            first, last = min(self.blocks), max(self.blocks)
+            if first < start:
+                self.drop_blocks(first, start - 1)
+            if end < last:
+                self.drop_blocks(end + 1, last)
+            start = max(start, last + 1)
+        if start <= end:
+            self.append_blockspan(start, end)
+
+    def slide_blocktime(self, start, end):
+        """Move the loaded window to the blocks mined from ``start`` up
+        to ``end``, see ``slide_blockspan``."""
+        first, last = self.blocktime_span(start, end)
+        if first is None:
+            self.drop_blocks(0, max(self.blocks, default=-1))
+            return
+        self.slide_blockspan(first, last)
+
+    @curse
+    @query
+    def blocktime_span(self, curs):
+        """
+        SELECT min(b_number), max(b_number)
+        FROM bitcoin.block
+        WHERE b_timestamp <@ tstzrange(%s, %s)
+        """
+        return curs.fetchone()
+
+    def slice(self, first, last):
+        """A view of the loaded blocks ``first`` to ``last`` inclusive,
+        see ``ChainSlice``."""
+        return ChainSlice(self, first, last)
+
+    def slice_blocktime(self, start, end):
+        """A view of the loaded blocks mined from ``start`` up to
+        ``end``."""
+        first, last = self.blocktime_span(start, end)
+        if first is None:
+            raise ValueError(f"No blocks between {start} and {end}.")
+        return self.slice(first, last)
 
     def clear(self):
         self.blocks.clear()
+        self.matrix_cache.clear()
         self.BT = maximal_matrix(UINT64)
         self.IT = maximal_matrix(UINT64)
         self.TO = maximal_matrix(UINT64)
@@ -142,8 +720,90 @@ class Chain:
         self.ST = maximal_matrix(UINT64)
         self.TR = maximal_matrix(UINT64)
 
+    @lazy
+    def address_cache(self):
+        return LRUCache(self.address_cache_size)
+
+    def resolve_addresses(self, curs, addresses, inserted=None):
+        """Map addresses to ids, inserting the ones never seen before.
+
+        Hot addresses are answered from ``address_cache``, the rest are
+        upserted and looked up in a single round trip.  The addresses
+        this call inserted are added to the ``inserted`` dict.
+        """
+        cache = self.address_cache
+        ids = {}
+        misses = []
+        for a in addresses:
+            if a in cache:
+                ids[a] = cache[a]
+            else:
+                misses.append(a)
+        if not misses:
+            return ids
+
+        curs.execute(
+            """
+            WITH new AS (
+                INSERT INTO bitcoin.address (a_address)
+                SELECT unnest(%s::text[]) ORDER BY 1
+                ON CONFLICT DO NOTHING
+                RETURNING a_address, a_id
+            )
+            SELECT a_address, a_id, true FROM new
+            UNION ALL
+            SELECT a_address, a_id, false
+            FROM bitcoin.address WHERE a_address = any(%s)
+            """,
+            (misses, misses),
+        )
+        found = {}
+        for a, a_id, new in curs.fetchall():
+            found[a] = a_id
+            if new and inserted is not None:
+                inserted[a] = a_id
+        if len(found) < len(misses):
+            # addresses inserted by a concurrent import that committed
+            # after this statement's snapshot was taken.
+            curs.execute(
+                """
+                SELECT a_address, a_id FROM bitcoin.address WHERE a_address = any(%s)
+                """,
+                ([a for a in misses if a not in found],),
+            )
+            found.update(curs.fetchall())
+
+        assert len(found) == len(misses)
+
+        for a, a_id in found.items():
+            cache[a] = a_id
+        ids.update(found)
+        return ids
+
+    @lazy
+    def tx_ids(self):
+        """Tx hashes and ids of imported txs, on disk."""
+        return IdDict(self.block_path / "iddict" / "tx")
+
+    @lazy
+    def address_ids(self):
+        """Addresses and ids of imported addresses, on disk."""
+        return IdDict(self.block_path / "iddict" / "address")
+
+    def address(self, a):
+        a_id = self.address_ids.id(a)
+        if a_id is not None:
+            return Address(self, a_id, a)
+        return self.lookup_address(a)
+
+    def tx(self, hash):
+        t_id = self.tx_ids.id(hash)
+        if t_id is not None:
+            return Tx(self, t_id, hash)
+        return self.lookup_tx(hash)
+
     @curse
-    def address(self, curs, a):
+    def lookup_address(self, curs, a):
         curs.execute(
             "SELECT a_id, a_address " "FROM bitcoin.address where a_address = %s", (a,)
         )
@@ -151,7 +811,7 @@ class Chain:
         return Address(self, a_id, a_address)
 
     @curse
-    def tx(self, curs, hash):
+    def lookup_tx(self, curs, hash):
         curs.execute(
             "SELECT t_id, t_hash FROM " "bitcoin.tx where t_hash = %s", (hash,)
         )
@@ -161,24 +821,224 @@ class Chain:
     @curse
     def initialize_blocks(self, curs):
         tic = time()
-        self.logger.info("Running BigQuery for blocks.")
-        client = bigquery.Client()
-        query = """
-        SELECT number, `hash`, timestamp, timestamp_month
-        FROM `bigquery-public-data.crypto_bitcoin.blocks`
-        ORDER BY number;
-        """
-        bq_blocks = list(client.query(query))
+        self.logger.info(f"Reading blocks from {self.source}.")
+        bq_blocks = list(self.source.blocks())
         self.logger.info(f"Initializing {len(bq_blocks)} blocks.")
-        curs.executemany(
+        self.insert_blocks(curs, bq_blocks)
+        self.conn.commit()
+        self.logger.info(f"Initialized blocks in {time() - tic:.2f}s")
+
+    def insert_blocks(self, curs, blocks):
+        copy_rows(
+            curs,
+            "bitcoin.base_block",
+            ("b_number", "b_hash", "b_timestamp", "b_timestamp_month"),
+            (
+                (b["number"], b["hash"], b["timestamp"], b["timestamp_month"])
+                for b in blocks
+            ),
+        )
+
+    @curse
+    @query
+    def last_block(self, curs):
+        """
+        SELECT b_number, b_timestamp_month
+        FROM bitcoin.base_block
+        ORDER BY b_number DESC
+        LIMIT 1
+        """
+        return curs.fetchone()
+
+    @curse
+    @query
+    def last_imported_block(self, curs):
+        """
+        SELECT b_number, b_timestamp_month
+        FROM bitcoin.block
+        ORDER BY b_number DESC
+        LIMIT 1
+        """
+        return curs.fetchone()
+
+    @curse
+    @query
+    def unimported_blocks(self, curs):
+        """
+        SELECT b_number, b_hash, b_timestamp, b_timestamp_month
+        FROM bitcoin.base_block
+        WHERE b_number > %s AND b_imported_at IS NULL
+        ORDER BY b_number
+        """
+        return [
+            dict(number=b[0], hash=b[1], timestamp=b[2], timestamp_month=b[3])
+            for b in curs.fetchall()
+        ]
+
+    @curse
+    def poll(self, curs):
+        """Import the blocks past the newest imported block and append
+        them to the loaded chain.
+
+        New blocks the source has past the newest block in the database
+        are inserted first, then every block not imported yet is
+        imported in order, so blocks left over by a failed poll are
+        retried.  A block the source has no tx rows for yet stops the
+        poll before it, to be retried on the next one.  The tx partition
+        of the current month is grown to fit the new blocks, and months
+        that are complete get their rollups written.  Blocks committed
+        before a failure are still appended.  Returns the new blocks.
+        """
+        last = self.last_imported_block()
+        after, last_month = last if last else (-1, None)
+        newest = self.last_block()
+        new = list(self.source.blocks(after=newest[0] if newest else None))
+        if new:
+            self.insert_blocks(curs, new)
+            self.conn.commit()
+        rows = self.unimported_blocks(after)
+        if not rows:
+            return []
+
+        committed = []
+        blocks = []
+        closed = False
+        try:
+            for month, month_rows in groupby(rows, itemgetter("timestamp_month")):
+                numbers = [r["number"] for r in month_rows]
+                if last_month is not None and month != last_month:
+                    self.rollup_month(last_month)
+                    self.merge_iddicts(last_month)
+                    closed = True
+                last_month = month
+                self.extend_month(month)
+                self.conn.commit()
+                txs = self.source.transactions(month, numbers[0], numbers[-1])
+                groups = groupby(txs, itemgetter("b_number"))
+                built = 0
+                for number, (bn, group) in zip(numbers, groups):
+                    if bn != number:
+                        break
+                    block = self.build_block_graph(list(group), bn, month)
+                    # bulk rows are flushed per block so that every block
+                    # in committed is imported in Postgres
+                    self.flush()
+                    committed.append((month, block))
+                    built += 1
+                if built < len(numbers):
+                    self.logger.info(f"No txs for block {numbers[built]} yet.")
+                    break
+        finally:
+            for month, group in groupby(committed, itemgetter(0)):
+                built = [b for _, b in group]
+                self.write_iddicts(
+                    f"{month}_{built[0].number}_{built[-1].number}",
+                    [r for b in built for r in b.tx_rows],
+                    [(i, a) for b in built for a, i in b.new_addresses.items()],
+                )
+                # months before the last one polled are complete
+                self.merge_iddicts(month, IDDICT_SEGMENTS if month == last_month else 0)
+                # the built blocks hold their matrices and rows, the
+                # loaded chain only needs to know where their files are
+                blocks += [Block(self, b.number, b.hash) for b in built]
+            if closed:
+                self.reindex_iddicts()
+            if blocks:
+                self.append_blocks(blocks)
+                self.logger.info(
+                    f"Followed {len(blocks)} new blocks to {blocks[-1].number}"
+                )
+        return blocks
+
+    @lazy
+    def stopped(self):
+        return Event()
+
+    def follow(self, poll_interval=POLL_INTERVAL, background=False):
+        """Keep polling the source for new blocks until ``stop`` is called.
+
+        With ``background`` the chain is followed on a daemon thread,
+        which is returned, so the loaded matrices can be queried while
+        new blocks are appended to them.
+        """
+        if background:
+            thread = Thread(
+                target=self.follow, args=(poll_interval,), name="follow", daemon=True
+            )
+            thread.start()
+            return thread
+        self.stopped.clear()
+        while not self.stopped.is_set():
+            try:
+                blocks = self.poll()
+            except Exception:
+                self.rollback()
+                self.logger.exception("Polling for new blocks failed.")
+                blocks = []
+            if not blocks:
+                self.stopped.wait(poll_interval)
+
+    def stop(self):
+        self.stopped.set()
+
+    def rollback(self):
+        """Abort the open transaction, forgetting the address ids and
+        buffered rows that may have come from it."""
+        self.conn.rollback()
+        self.address_cache.clear()
+        unload(self, "copy_buffer")
+
+    @lazy
+    def copy_buffer(self):
+        return CopyBuffer()
+
+    def buffer_block(self, number, month, tx_rows, receivers):
+        """Queue a finalized block's rows for the next bulk flush.
+
+        The block is only marked imported when its rows are flushed, so
+        an interrupted bulk import leaves no half imported blocks.
+        """
+        self.copy_buffer.add(f'bitcoin."base_tx_{month}"', ("t_id", "t_hash"), tx_rows)
+        self.copy_buffer.add(
+            "block_address",
+            ("b_number", "a_id"),
+            [(number, None)] + [(number, a) for a in receivers],
+        )
+        if len(self.copy_buffer) >= self.flush_rows:
+            self.flush()
+
+    @curse
+    def flush(self, curs):
+        """Copy buffered rows into Postgres and mark their blocks imported."""
+        if not len(self.copy_buffer):
+            return
+        tic = time()
+        rows = len(self.copy_buffer)
+        curs.execute(
+            """
+            CREATE TEMP TABLE IF NOT EXISTS block_address (
+                b_number integer,
+                a_id bigint
+            )
             """
-            INSERT INTO bitcoin.base_block
-            (b_number, b_hash, b_timestamp, b_timestamp_month)
-            VALUES (%(number)s, %(hash)s, %(timestamp)s, %(timestamp_month)s)
-            """,
-            bq_blocks,
         )
+        with metrics.span("sql.copy"):
+            self.copy_buffer.flush(curs)
+        metrics.count("copy.rows", rows)
+        with metrics.span("sql.update_blocks"):
+            curs.execute(
+                """
+                UPDATE bitcoin.base_block
+                    SET b_addresses = s.agg,
+                        b_imported_at = now()
+                    FROM (SELECT b_number, hll_add_agg(hll_hash_bigint(a_id)) as agg
+                          FROM block_address GROUP BY b_number) s
+                WHERE base_block.b_number = s.b_number
+                """
+            )
+        curs.execute("TRUNCATE block_address")
         self.conn.commit()
+        self.logger.debug(f"Flushed {rows} rows in {time() - tic:.4f}")
 
     @curse
     @query
@@ -219,7 +1079,54 @@ class Chain:
         for b in curs.fetchall():
             self.blocks[b[0]] = Block(self, b[0], b[1])
 
-    def import_blocktime(self, start, end):
+    def write_rollup(self, name, parts):
+        """Merge ``parts`` (blocks or smaller rollups, in block order) into
+        a single rollup called ``name`` and write it to disk.
+        """
+        parts = list(parts)
+        if not parts:
+            return
+        rollup = Rollup(self, name, parts[0].span[0], parts[-1].span[1])
+        for old in self.rollups:
+            if old.name == name:
+                old.remove_block_files()
+        for suffix in SUFFIXES:
+            setattr(rollup, suffix, self.merge_block_graphs(suffix, blocks=parts))
+        rollup.write_block_files()
+        self.logger.info(f"Wrote {rollup}")
+        return rollup
+
+    @curse
+    @query
+    def month_blocks(self, curs):
+        """
+        SELECT b_number, b_hash
+        FROM bitcoin.block
+        WHERE b_timestamp_month = %s
+        ORDER BY b_number
+        """
+        return [Block(self, b[0], b[1]) for b in curs.fetchall()]
+
+    def rollup_month(self, month):
+        return self.write_rollup(str(month)[:7], self.month_blocks(month))
+
+    def rollup_year(self, year):
+        """Roll up the twelve month rollups of ``year``, if they all exist."""
+        months = [r for r in self.rollups if r.name.startswith(f"{year}-")]
+        if len(months) != 12:
+            self.logger.debug(f"Only {len(months)} months rolled up for {year}")
+            return
+        return self.write_rollup(str(year), sorted(months, key=lambda r: r.span))
+
+    def rollup_blocktime(self, start, end, years=True):
+        months = self.months(start, end)
+        for month in months:
+            self.rollup_month(month)
+        if years:
+            for year in sorted({m.year for m in months}):
+                self.rollup_year(year)
+
+    def months(self, start, end):
         with pg.connect(self.dsn) as conn:
             with conn.cursor() as curs:
                 curs.execute(
@@ -228,17 +1135,43 @@ class Chain:
                     """,
                     (start, end),
                 )
-                months = [x[0] for x in curs.fetchall()]
-        if self.pool_size == 1:
+                return [x[0] for x in curs.fetchall()]
+
+    def import_blocktime(self, start, end, years=True, shard_blocks=SHARD_BLOCKS):
+        months = self.months(start, end)
+        if self.pool_size == 1 or not self.source.parallel:
             result = list(map(self.import_month, months))
         else:
-            pool = Pool(self.pool_size)
-            result = list(pool.map(self.import_month, months, 1))
+            result = self.import_shards(months, shard_blocks)
+        self.reindex_iddicts()
 
+        if years:
+            for year in sorted({m.year for m in months}):
+                self.rollup_year(year)
         return result
 
+    @curse
+    @query
+    def month_partition(self, curs):
+        """Whether the tx partition of a month exists and whether it is
+        attached to ``base_tx``:
+
+            WITH p AS (
+                SELECT to_regclass(format(
+                    'bitcoin.%%I', 'base_tx_' || replace(%s::date::text, '-', '_')
+                )) AS r
+            )
+            SELECT r IS NOT NULL, EXISTS (SELECT FROM pg_inherits WHERE inhrelid = r)
+            FROM p
+        """
+        return curs.fetchone()
+
     @curse
     def create_month(self, curs, month):
+        # adding the partition's id range check is not idempotent
+        if self.month_partition(month)[0]:
+            self.logger.debug(f"Partitions for {month} already exist")
+            return
         self.logger.debug(f"Creating partitions for {month}")
         curs.execute(f"CALL bitcoin.create_month('{month}')")
 
@@ -247,73 +1180,258 @@ class Chain:
         self.logger.debug(f"Indexing and attaching partitions for {month}")
         curs.execute(f"CALL bitcoin.index_and_attach('{month}')")
 
+    @curse
+    def extend_month(self, curs, month):
+        self.logger.debug(f"Extending partitions for {month}")
+        curs.execute(f"CALL bitcoin.extend_month('{month}')")
+
     @curse
     @query
-    def check_block_imported(self, curs):
+    def imported_blocks(self, curs):
+        """
+        SELECT b_number FROM bitcoin.block WHERE b_timestamp_month = %s
+        """
+        return {b[0] for b in curs.fetchall()}
+
+    def import_shards(self, months, shard_blocks=SHARD_BLOCKS):
+        """Import ``months`` in shards of at most ``shard_blocks`` blocks
+        on ``pool_size`` worker processes.
+
+        Workers take the next shard as soon as they finish one, so a
+        busy month is spread over every worker instead of being the
+        last one running.  Each worker gets a copy of the chain without
+        connections or caches and opens its own connections and source
+        stream once.  The coordinator creates the partitions of every
+        month up front, and indexes, attaches and rolls up each month
+        as its last shard comes in, logging the rate and time left.
+        Months with nothing left to import that are already attached
+        are left alone.
+
+        Sources that are not ``shardable`` are fetched once per month,
+        ahead of the month's shards, into a recording under
+        ``block_path/spool`` that the workers replay their block ranges
+        of.
         """
-        SELECT EXISTS (
-            SELECT 1 FROM bitcoin.block WHERE b_number = %s
+        shards = {}
+        for month in months:
+            self.create_month(month)
+            shards[month] = [
+                (month, first, last)
+                for first, last in self.month_shards(month, shard_blocks)
+            ]
+        self.conn.commit()
+
+        remaining = Counter({month: len(s) for month, s in shards.items()})
+        for month in months:
+            if not remaining[month] and not self.month_partition(month)[1]:
+                self.finish_month(month)
+
+        spool = None if self.source.shardable else self.block_path / "spool"
+
+        def queue():
+            # runs on the pool's task thread, so months are fetched
+            # while the workers import the ones before them
+            for month in months:
+                if spool and shards[month]:
+                    with metrics.span("source.fetch_month"):
+                        RecordSource(self.source, spool).transactions(month)
+                yield from shards[month]
+
+        progress = Progress(
+            sum(last - first + 1 for s in shards.values() for _, first, last in s)
         )
+        result = []
+        worker_source = spool and ReplaySource(spool)
+        with Pool(self.pool_size, init_worker, (self, worker_source)) as pool:
+            for stats in pool.imap_unordered(import_shard, queue(), 1):
+                metrics.merge(stats.pop("metrics"))
+                result.append(stats)
+                month = stats["month"]
+                progress.update(stats["end"] - stats["start"] + 1, txs=stats["txs"])
+                self.logger.info(
+                    f"Imported blocks {stats['start']} to {stats['end']} "
+                    f"of {month}: {progress}"
+                )
+                remaining[month] -= 1
+                if not remaining[month]:
+                    self.finish_month(month)
+                    if spool:
+                        shutil.rmtree(recording(spool, month), ignore_errors=True)
+        return result
+
+    def month_shards(self, month, shard_blocks=SHARD_BLOCKS):
+        """The blocks of ``month`` not imported yet, as ``(first, last)``
+        ranges of at most ``shard_blocks`` blocks."""
+        numbers = self.pending_blocks(month)
+        return [
+            (group[0], [n for n in group if n is not None][-1])
+            for group in grouper(numbers, shard_blocks)
+        ]
+
+    @curse
+    @query
+    def pending_blocks(self, curs):
         """
-        return curs.fetchone() is not None
+        SELECT b_number FROM bitcoin.base_block
+        WHERE b_timestamp_month = %s AND b_imported_at IS NULL
+        ORDER BY b_number
+        """
+        return [b[0] for b in curs.fetchall()]
 
     # @retry(stop=stop_after_attempt(3))
     def import_month(self, month):
         tic = time()
-        client = bigquery.Client()
-
         self.create_month(month)
-
         self.logger.info(f"Loading {month}")
+        self.import_shard(month)
+        self.finish_month(month)
+        self.logger.info(f"Took {(time() - tic)/60.0} minutes for {month}")
 
-        query = f"""
-        WITH TIDS AS (
-            SELECT
-                block_number,
-                block_hash,
-                block_timestamp,
-                block_timestamp_month, `hash`, inputs, outputs,
-                (block_number << 32) + (ROW_NUMBER()
-                    OVER(PARTITION BY block_number ORDER BY block_number, `hash`) << 16) AS t_id
-        FROM `bigquery-public-data.crypto_bitcoin.transactions`
-        ORDER BY block_number, `hash`)
-
-        SELECT
-            t.t_id as t_id,
-            t.block_number as b_number,
-            t.block_hash as b_hash,
-            t.block_timestamp as b_timestamp,
-            t.block_timestamp_month as b_timestamp_month,
-            t.`hash` as t_hash,
-            spents.t_id as i_spent_tid,
-            i.spent_output_index as i_spent_index,
-            i.addresses as i_addresses,
-            i.value as i_value,
-            i.index as i_index,
-            o.index as o_index,
-            o.addresses as o_addresses,
-            o.value as o_value
-        FROM tids t LEFT JOIN UNNEST(inputs) as i,
-        UNNEST(outputs) as o
-        LEFT JOIN tids spents on (i.spent_transaction_hash = spents.`hash`)
-        WHERE t.block_timestamp_month = '{month}'
-        ORDER BY t.block_number, t.`hash`, i.index, o.index
-        """
-        for bn, group in groupby(client.query(query), itemgetter("b_number")):
-            if self.check_block_imported(bn):
-                self.logger.debug(f"Block {bn} already done.")
-                continue
-            self.build_block_graph(group, bn, month)
-
-        self.index_and_attach(month)
+    def finish_month(self, month):
+        """Index and attach the partitions of an imported month, unless
+        they already are, and roll it up."""
+        if not self.month_partition(month)[1]:
+            self.index_and_attach(month)
+            self.conn.commit()
+        self.rollup_month(month)
+        self.merge_iddicts(month)
+
+    def import_shard(self, month, start=None, end=None):
+        """Import the blocks ``start`` to ``end`` inclusive of ``month``,
+        or all of it, into the month's partitions, which must exist.
+        Blocks imported by an earlier run are skipped."""
+        tic = time()
+        with metrics.span("source.transactions"):
+            rows = self.source.transactions(month, start, end)
+        rows = metrics.iterate("source.rows", rows)
+
+        imported = {
+            n
+            for n in self.imported_blocks(month)
+            if (start is None or start <= n) and (end is None or n <= end)
+        }
+        groups = (
+            list(group)
+            for bn, group in groupby(rows, itemgetter("b_number"))
+            if bn not in imported
+        )
+        txs = self.month_txs(month, imported) if imported else []
+        addresses = []
+        nblocks = ntxs = 0
+        for block in self.import_blocks(groups, month):
+            txs.extend(block.tx_rows)
+            addresses.extend((a_id, a) for a, a_id in block.new_addresses.items())
+            nblocks += 1
+            ntxs += len(block.tx_rows)
+            self.logger.debug(f"Wrote block {block.number}")
+
+        self.flush()
         self.conn.commit()
-        self.logger.info(f"Took {(time() - tic)/60.0} minutes for {month}")
+        name = str(month) if start is None else f"{month}_{start}_{end}"
+        self.write_iddicts(name, txs, addresses)
+        return dict(
+            month=month,
+            start=start,
+            end=end,
+            blocks=nblocks,
+            txs=ntxs,
+            seconds=time() - tic,
+        )
+
+    @curse
+    def month_txs(self, curs, month, numbers):
+        """Tx ids and hashes already written for blocks ``numbers``."""
+        month = str(month).replace("-", "_")
+        curs.execute(
+            f"""
+            SELECT t_id, t_hash FROM bitcoin."base_tx_{month}"
+            WHERE (t_id >> 32)::integer = any(%s)
+            """,
+            (list(numbers),),
+        )
+        return curs.fetchall()
+
+    def write_iddicts(self, name, txs, addresses):
+        """Save the import unit ``name``'s txs and newly seen addresses
+        as id dictionary segments.  Addresses first seen by an earlier,
+        interrupted run of the same unit are only in Postgres."""
+        self.tx_ids.write(name, txs)
+        self.address_ids.write(name, addresses)
+
+    def merge_iddicts(self, month, limit=0):
+        """Merge the id dictionary segments written for polls or shards
+        of ``month`` into one named after the month, once there are
+        more than ``limit`` of them."""
+        prefix = f"{month}_"
+        for iddict in (self.tx_ids, self.address_ids):
+            iddict.refresh()
+            names = [
+                s.path.name for s in iddict.segments if s.path.name.startswith(prefix)
+            ]
+            if len(names) > limit:
+                iddict.merge(str(month), names)
+
+    def reindex_iddicts(self):
+        """Index the digests of every id dictionary segment together."""
+        for iddict in (self.tx_ids, self.address_ids):
+            iddict.reindex()
+
+    def import_blocks(self, groups, month):
+        """Import row groups, one per block, through a staged pipeline.
+
+        Decoding rows, building the block matrices (which resolves
+        address ids on a connection of its own), writing block files and
+        writing tx rows to Postgres all run concurrently with at most
+        ``queue_size`` blocks waiting between stages.  Yields each block
+        once it is committed.
+        """
+        build_conn = self.build_conn
+
+        def build(block):
+            with metrics.span("build_graphs"):
+                with build_conn.cursor() as curs:
+                    block.build_graphs(curs)
+                build_conn.commit()
+            return block
+
+        def write_files(block):
+            block.write_block_files(self.block_path)
+            return block
+
+        def write_rows(block):
+            with metrics.span("write_rows"):
+                with self.conn.cursor() as curs:
+                    block.write_rows(curs, month)
+                self.conn.commit()
+            block.pending_txs.clear()
+            metrics.count("blocks")
+            return block
+
+        yield from pipeline(
+            groups,
+            metrics.timed("parse_block")(self.parse_block),
+            build,
+            write_files,
+            write_rows,
+            maxsize=self.queue_size,
+        )
 
+    @metrics.timed("build_block_graph")
     def build_block_graph(self, group, bn, month):
+        tic = time()
+        block = self.parse_block(group)
+        block.finalize(month)
 
+        self.conn.commit()
+        metrics.count("blocks")
+        self.logger.debug(f"Wrote block {block.number} in {time()-tic:.4f}")
+        return block
+
+    def parse_block(self, group):
+        """Decode one block's rows into a Block with pending txs."""
         t_id = None
         block = None
-        tic = time()
+        metrics.count("rows", len(group))
 
         for t in map(Object, group):
 
@@ -344,10 +1462,56 @@ class Chain:
                 for o_address in t.o_addresses:
                     tx.pending_output_addresses[o_address].append((t_id, o_id, o_value))
 
-        block.finalize(month)
+        return block
+
+    def relation(self, M, ids, row, col, value="value"):
+        """Columns of the entries in the rows ``ids`` of ``M``, as
+        arrays named ``row``, ``col`` and ``value``."""
+        I, J, V = select_ids(M, ids).to_lists()
+        return {
+            row: np.array(I, dtype=np.uint64),
+            col: np.array(J, dtype=np.uint64),
+            value: np.array(V, dtype=np.uint64),
+        }
+
+    def block_txs(self, numbers):
+        """The txs of many blocks, ``numbers`` are block numbers."""
+        ids = np.asarray(numbers, dtype=np.uint64) << np.uint64(32)
+        return self.relation(self.BT, ids, "block", "tx")
+
+    def tx_inputs(self, tx_ids):
+        return self.relation(self.IT_T, tx_ids, "tx", "input")
+
+    def tx_outputs(self, tx_ids):
+        return self.relation(self.TO, tx_ids, "tx", "output")
+
+    def spent_txs(self, output_ids):
+        """The txs spending many outputs, unspent outputs are left out."""
+        return self.relation(self.IT, output_ids, "output", "tx")
+
+    def spend_addresses(self, spend_ids):
+        """The addresses of many outputs, or of inputs for spends that
+        are not outputs of a loaded block, like ``Spend.addresses``."""
+        outputs = self.relation(self.OR, spend_ids, "spend", "address")
+        missing = np.setdiff1d(
+            np.asarray(spend_ids, dtype=np.uint64), outputs["spend"]
+        )
+        if not len(missing):
+            return outputs
+        inputs = self.relation(self.SI_T, missing, "spend", "address")
+        return {k: np.concatenate((outputs[k], inputs[k])) for k in outputs}
 
-        self.conn.commit()
-        self.logger.debug(f"Wrote block {block.number} in {time()-tic:.4f}")
+    def address_sent(self, address_ids):
+        return self.relation(self.SI, address_ids, "address", "input")
+
+    def address_received(self, address_ids):
+        return self.relation(self.OR_T, address_ids, "address", "output")
+
+    def address_txs_as_sender(self, address_ids):
+        return self.relation(self.ST, address_ids, "address", "tx")
+
+    def address_txs_as_receiver(self, address_ids):
+        return self.relation(self.TR_T, address_ids, "address", "tx")
 
     def __iter__(self):
         return iter(self.blocks.values())
@@ -413,3 +1577,101 @@ Adjacencies:
             f"<Bitcoin chain of {len(self.blocks)} blocks "
             f"between {min_block} and {max_block}>"
         )
+
+
+class ChainSlice(Chain):
+    """The blocks ``first`` to ``last`` of an already loaded chain.
+
+    A block range is one id range on the tx side of every base matrix,
+    so the slice's base matrices are selected out of the parent's by
+    index range when first used, instead of read again from the block
+    files, and its adjacencies are computed from those.  Connections,
+    id dictionaries and metadata caches are shared with the parent.
+    """
+
+    def __init__(self, parent, first, last):
+        self.chain = self
+        self.parent = parent
+        for name in (
+            "dsn",
+            "block_path",
+            "pool_size",
+            "logger",
+            "address_cache_size",
+            "bulk",
+            "flush_rows",
+            "queue_size",
+            "source",
+            "matrix_budget",
+        ):
+            setattr(self, name, getattr(parent, name))
+        self.first = first
+        self.last = last
+        self.lo, self.hi = block_range(first, last)
+        self.blocks = OrderedDict(
+            (n, b) for n, b in parent.blocks.items() if first <= n <= last
+        )
+
+    def select(self, suffix):
+        M = getattr(self.parent, suffix)
+        return select_range(M, self.lo, self.hi, TX_AXES[suffix])
+
+    @cached
+    def BT(self):
+        return self.select("BT")
+
+    @cached
+    def IT(self):
+        return self.select("IT")
+
+    @cached
+    def TO(self):
+        return self.select("TO")
+
+    @cached
+    def SI(self):
+        # the outputs spent by the slice's txs, as rows of the parent's
+        # SI_T so only those rows are visited
+        return select_ids(self.parent.SI_T, present(self.IT)).transpose()
+
+    @cached
+    def OR(self):
+        return self.select("OR")
+
+    @cached
+    def ST(self):
+        return self.select("ST")
+
+    @cached
+    def TR(self):
+        return self.select("TR")
+
+    @property
+    def conn(self):
+        return self.parent.conn
+
+    @property
+    def thread_pool(self):
+        return self.parent.thread_pool
+
+    @property
+    def resolver(self):
+        return self.parent.resolver
+
+    @property
+    def address_cache(self):
+        return self.parent.address_cache
+
+    @property
+    def tx_ids(self):
+        return self.parent.tx_ids
+
+    @property
+    def address_ids(self):
+        return self.parent.address_ids
+
+    def __repr__(self):
+        return (
+            f"<Bitcoin chain slice of {len(self.blocks)} blocks "
+            f"between {self.first} and {self.last}>"
+        )
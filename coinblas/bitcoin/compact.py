@@ -0,0 +1,169 @@
+import numpy as np
+
+from pygraphblas import (
+    INT64,
+    UINT64,
+    Matrix,
+    Vector,
+    descriptor,
+    lib,
+    semiring,
+)
+
+from coinblas.util import lazy, maximal_vector, GxB_INDEX_MAX
+
+
+def rows(M):
+    """Sorted ids of the non-empty rows of ``M``."""
+    return np.array(M.reduce_vector().to_lists()[0], dtype=np.uint64)
+
+
+def cols(M):
+    """Sorted ids of the non-empty columns of ``M``."""
+    return np.array(
+        M.reduce_vector(desc=descriptor.T0).to_lists()[0], dtype=np.uint64
+    )
+
+
+def selector(ids):
+    """The ``len(ids)`` by 2^60 matrix with a one at ``(i, ids[i])``."""
+    n = len(ids)
+    P = Matrix.sparse(UINT64, n, GxB_INDEX_MAX)
+    if n:
+        P.build(list(range(n)), ids.tolist(), [1] * n)
+    return P
+
+
+class Compact:
+    """The loaded chain renumbered to contiguous indices.
+
+    Addresses, txs and spends (outputs, which inputs spend) present in
+    the chain are numbered ``0..n-1`` in id order and every matrix is
+    rebuilt in those dimensions, ``P @ M @ Q.T`` with selector matrices
+    ``P`` and ``Q``.  Compact vectors are small enough for SuiteSparse
+    to hold in bitmap or dense form, which iterative algorithms run
+    much faster on than hypersparse 2^60 wide ones.
+
+    ``index`` and ``ids`` map between blocktime ids and indices.  The
+    view is a snapshot, blocks appended to the chain afterwards are not
+    in it.
+    """
+
+    kinds = ("address", "tx", "spend")
+
+    def __init__(self, chain):
+        self.chain = chain
+
+    @lazy
+    def address(self):
+        """Address ids by compact index."""
+        return np.union1d(rows(self.chain.ST), cols(self.chain.TR))
+
+    @lazy
+    def tx(self):
+        """Tx ids by compact index."""
+        return np.union1d(rows(self.chain.TO), cols(self.chain.IT))
+
+    @lazy
+    def spend(self):
+        """Output and input ids by compact index."""
+        return np.union1d(rows(self.chain.IT), cols(self.chain.TO))
+
+    def ids(self, kind, index):
+        """Blocktime ids of compact indices of ``kind``."""
+        return getattr(self, kind)[np.asarray(index, dtype=np.int64)]
+
+    def index(self, kind, ids):
+        """Compact indices of blocktime ids of ``kind``, -1 for ids that
+        are not in the view."""
+        table = getattr(self, kind)
+        ids = np.asarray(ids, dtype=np.uint64)
+        index = np.searchsorted(table, ids)
+        found = index < len(table)
+        found[found] = table[index[found]] == ids[found]
+        return np.where(found, index, -1)
+
+    @lazy
+    def selectors(self):
+        return {kind: selector(getattr(self, kind)) for kind in self.kinds}
+
+    def compact(self, M, row_kind, col_kind):
+        """``M`` in the compact dimensions of ``row_kind`` by ``col_kind``."""
+        P = self.selectors[row_kind]
+        Q = self.selectors[col_kind]
+        with semiring.ANY_SECOND_UINT64:
+            PM = P @ M
+        with semiring.ANY_FIRST_UINT64:
+            return PM @ Q.T
+
+    def expand(self, v, kind):
+        """A compact vector of ``kind`` as a vector indexed by id."""
+        I, V = v.to_lists()
+        out = maximal_vector(v.type)
+        if I:
+            out.build(self.ids(kind, I).tolist(), V)
+        return out
+
+    @lazy
+    def IT(self):
+        return self.compact(self.chain.IT, "spend", "tx")
+
+    @lazy
+    def TO(self):
+        return self.compact(self.chain.TO, "tx", "spend")
+
+    @lazy
+    def SI(self):
+        return self.compact(self.chain.SI, "address", "spend")
+
+    @lazy
+    def OR(self):
+        return self.compact(self.chain.OR, "spend", "address")
+
+    @lazy
+    def ST(self):
+        return self.compact(self.chain.ST, "address", "tx")
+
+    @lazy
+    def TR(self):
+        return self.compact(self.chain.TR, "tx", "address")
+
+    @lazy
+    def IO(self):
+        return self.compact(self.chain.IO, "spend", "spend")
+
+    @lazy
+    def SR(self):
+        return self.compact(self.chain.SR, "address", "address")
+
+    @lazy
+    def TT(self):
+        return self.compact(self.chain.TT, "tx", "tx")
+
+    def bfs_level(self, address, depth=lib.GxB_INDEX_MAX):
+        """``Address.bfs_level`` in compact space, the result is indexed
+        by compact address index, ``expand`` maps it back to ids."""
+        SR = self.SR
+        n = len(self.address)
+        (source,) = self.index("address", [getattr(address, "id", address)])
+        if source < 0:
+            raise KeyError(f"Address {address} is not in the view.")
+        q = Vector.sparse(INT64, n)
+        pi = q.dup()
+        q[int(source)] = 0
+        for level in range(min(depth + 1, SR.nvals)):
+            with semiring.ANY_PAIR_INT64:
+                q.vxm(SR, out=q, mask=pi, desc=descriptor.RSC)
+            if not q:
+                break
+            pi.assign_scalar(level + 1, mask=q, desc=descriptor.S)
+        return pi
+
+    def __len__(self):
+        return len(self.address)
+
+    def __repr__(self):
+        return (
+            f"<Compact {len(self.address)} addresses, {len(self.tx)} txs, "
+            f"{len(self.spend)} spends>"
+        )
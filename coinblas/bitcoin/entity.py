@@ -0,0 +1,175 @@
+from collections import defaultdict
+from pathlib import Path
+
+from pygraphblas import Matrix, UINT64, binaryop, descriptor, semiring
+
+from coinblas.util import build_matrix, lazy, maximal_vector, unload
+
+
+def address_vector(ST, TR):
+    """Vector of every sending or receiving address, valued by its id."""
+    senders = ST.reduce_vector()
+    receivers = TR.reduce_vector(desc=descriptor.T0)
+    I, _ = senders.eadd(receivers, binaryop.FIRST).to_lists()
+    v = maximal_vector(UINT64)
+    if I:
+        v.build(I, I)
+    return v
+
+
+def label_components(ST, labels):
+    """Label every address with the smallest address id it shares a
+    transaction input with, directly or transitively.
+
+    Works on the bipartite ST graph without forming ``ST @ ST.T``, in
+    the style of FastSV: each round every tx takes the smallest label
+    of its senders, every sender hooks onto the smallest label of its
+    txs, and labels are shortcut to their grandparent label.  Stops
+    when a round changes nothing.
+    """
+    while True:
+        with semiring.MIN_SECOND_UINT64:
+            tx_labels = ST.mxv(labels, desc=descriptor.T0)
+            hooked = ST.mxv(tx_labels)
+        new = labels.eadd(hooked, binaryop.MIN)
+        I, V = new.to_lists()
+        with semiring.MIN_SECOND_UINT64:
+            grandparents = build_matrix(UINT64, I, V, V).mxv(new)
+        new = new.eadd(grandparents, binaryop.MIN)
+        if new.iseq(labels):
+            return new
+        labels = new
+
+
+def membership(labels):
+    I, V = labels.to_lists()
+    return build_matrix(UINT64, I, V, [1] * len(I))
+
+
+class Entities:
+    """Addresses clustered into entities by common input ownership.
+
+    An entity id is the smallest address id in the entity.  The
+    clustering is saved next to the block files in the ``entity``
+    directory as ``{first}_{last}_AE.ssb`` for the span of blocks it
+    covers, and is reused when the same span is loaded again.
+    """
+
+    def __init__(self, chain):
+        self.chain = chain
+        self.saved = None
+
+    @property
+    def span(self):
+        return min(self.chain.blocks), max(self.chain.blocks)
+
+    def datafile(self, path=None):
+        first, last = self.span
+        path = Path(path or self.chain.block_path) / "entity"
+        return path / f"{first}_{last}_AE.ssb"
+
+    @lazy
+    def labels(self):
+        """ Vector of entity ids by address id. """
+        datafile = self.datafile()
+        if datafile.exists():
+            self.saved = datafile
+            I, J, _ = Matrix.from_binfile(bytes(datafile)).to_lists()
+            labels = maximal_vector(UINT64)
+            if I:
+                labels.build(I, J)
+            return labels
+        labels = label_components(
+            self.chain.ST, address_vector(self.chain.ST, self.chain.TR)
+        )
+        self.save(membership(labels))
+        return labels
+
+    @lazy
+    def AE(self):
+        """ Membership Matrix from Address id rows to Entity id columns. """
+        return membership(self.labels)
+
+    @lazy
+    def SR(self):
+        """ Adjacency Matrix from sending Entity id rows to receiving
+        Entity id columns, SR contracted to entities without self
+        edges. """
+        AE = self.AE
+        with semiring.PLUS_TIMES_UINT64:
+            return (AE.T @ self.chain.SR @ AE).offdiag()
+
+    def save(self, AE=None):
+        datafile = self.datafile()
+        datafile.parent.mkdir(parents=True, exist_ok=True)
+        (AE if AE is not None else self.AE).to_binfile(bytes(datafile))
+        if self.saved is not None and self.saved != datafile:
+            self.saved.unlink(missing_ok=True)
+        self.saved = datafile
+
+    def append(self, ST, TR):
+        """Merge the entities joined by the appended ``ST`` and ``TR``.
+
+        Only the labels touched by the new txs go through union-find,
+        existing addresses whose entity merged into another are then
+        relabeled in one pass over ``AE``.
+        """
+        new = address_vector(ST, TR)
+        known = self.labels.emult(new, binaryop.FIRST)
+        label = dict(zip(*new.to_lists()))
+        label.update(zip(*known.to_lists()))
+
+        parent = {}
+
+        def find(l):
+            root = l
+            while parent.get(root, root) != root:
+                root = parent[root]
+            while l != root:
+                parent[l], l = root, parent[l]
+            return root
+
+        senders = defaultdict(list)
+        I, J, _ = ST.to_lists()
+        for a, t in zip(I, J):
+            senders[t].append(label[a])
+        for group in senders.values():
+            roots = {find(l) for l in group}
+            root = min(roots)
+            for r in roots:
+                parent[r] = root
+
+        labels = self.labels
+        moved = {l: find(l) for l in parent if find(l) != l}
+        if moved:
+            remap = maximal_vector(UINT64)
+            remap.build(list(moved), list(moved.values()))
+            with semiring.MIN_SECOND_UINT64:
+                relabeled = self.AE.mxv(remap)
+            labels = labels.eadd(relabeled, binaryop.SECOND)
+
+        seen = set(known.to_lists()[0])
+        fresh = [(a, find(l)) for a, l in label.items() if a not in seen]
+        if fresh:
+            v = maximal_vector(UINT64)
+            v.build(*map(list, zip(*fresh)))
+            labels = labels.eadd(v, binaryop.SECOND)
+
+        self.labels = labels
+        unload(self, "AE")
+        unload(self, "SR")
+        self.save()
+
+    def entity(self, address):
+        """The entity id of an address or address id."""
+        return self.labels[getattr(address, "id", address)]
+
+    def members(self, entity):
+        """The ids of the addresses in an entity."""
+        return [a for a, _ in self.AE[:, entity]]
+
+    def __len__(self):
+        return len(set(self.labels.to_lists()[1]))
+
+    def __repr__(self):
+        return f"<Entities {self.span[0]} to {self.span[1]}>"
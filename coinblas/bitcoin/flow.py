@@ -0,0 +1,181 @@
+"""Tracing tainted value forward through txs.
+
+Taint is a ``FP64`` vector of satoshis indexed by output id.  One hop
+sums the taint of each tx's inputs through ``IT`` and hands it to the
+tx's outputs through ``TO`` by one of three models:
+
+    haircut  every output gets the tainted fraction of the tx's input
+             value times its own value
+    poison   every output of a tx with any tainted input is tainted
+             for its whole value
+    fifo     inputs and outputs are laid end to end in id order and an
+             output gets the taint it overlaps, with the taint of each
+             input at the start of the input
+
+Outputs are created by exactly one tx and spent by at most one later
+tx, so a trace never revisits an output and the taint of every hop is
+simply added up.
+"""
+import numpy as np
+
+from pygraphblas import FP64, binaryop, descriptor, lib, semiring
+
+from coinblas.util import (
+    block_range,
+    get_tx_id,
+    lazy,
+    maximal_vector,
+    select_ids,
+    select_range,
+)
+
+MODELS = ("haircut", "poison", "fifo")
+
+
+def fp64_vector(I, V):
+    v = maximal_vector(FP64)
+    if len(I):
+        v.build([int(i) for i in I], [float(x) for x in V])
+    return v
+
+
+def fifo(in_txs, in_values, in_taint, out_txs, out_values):
+    """The taint of each output under the fifo model.
+
+    Inputs and outputs are arrays sorted by tx and then by id.  Txs
+    are laid end to end on one axis, each input is the interval of its
+    value with its taint at the start, and each output takes the taint
+    its own interval overlaps.
+    """
+    in_values = np.asarray(in_values, dtype=np.float64)
+    in_taint = np.minimum(np.asarray(in_taint, dtype=np.float64), in_values)
+    out_values = np.asarray(out_values, dtype=np.float64)
+    starts = np.cumsum(in_values) - in_values
+    txs, first = np.unique(in_txs, return_index=True)
+    bases = starts[first]
+
+    tainted = in_taint > 0
+    starts, lengths = starts[tainted], in_taint[tainted]
+    before = np.cumsum(lengths) - lengths
+
+    def tainted_below(p):
+        k = np.searchsorted(starts, p, "right") - 1
+        found = k >= 0
+        out = np.zeros(len(p))
+        k = k[found]
+        out[found] = before[k] + np.minimum(p[found] - starts[k], lengths[k])
+        return out
+
+    ends = np.cumsum(out_values)
+    _, ofirst, counts = np.unique(out_txs, return_index=True, return_counts=True)
+    within = ends - out_values - np.repeat(ends[ofirst] - out_values[ofirst], counts)
+    a = bases[np.searchsorted(txs, out_txs)] + within
+    return tainted_below(a + out_values) - tainted_below(a)
+
+
+class Flow:
+    """Taint traced forward from seed outputs by one of ``MODELS``."""
+
+    def __init__(self, chain, model="haircut"):
+        if model not in MODELS:
+            raise ValueError(f"Unknown flow model {model}, not one of {MODELS}.")
+        self.chain = chain
+        self.model = model
+
+    @lazy
+    def in_value(self):
+        """The total input value of each tx."""
+        return self.chain.IT.reduce_vector(desc=descriptor.T0)
+
+    def output_values(self, ids):
+        ids = np.asarray(ids, dtype=np.uint64)
+        txs = np.unique([get_tx_id(int(i)) for i in ids]).tolist()
+        _, O, W = select_ids(self.chain.TO, txs).to_lists()
+        values = dict(zip(O, W))
+        return [values.get(int(i), 0) for i in ids]
+
+    def seed(self, outputs=(), addresses=()):
+        """The taint vector of ``outputs``, a mapping of output ids to
+        tainted amounts or a list of output ids tainted for their whole
+        value, and of every output received by ``addresses``."""
+        if hasattr(outputs, "items"):
+            I, V = list(outputs.keys()), list(outputs.values())
+        else:
+            I = list(outputs)
+            V = self.output_values(I)
+        if len(addresses):
+            ids = [getattr(a, "id", a) for a in addresses]
+            received = self.chain.address_received(ids)
+            I += received["output"].tolist()
+            V += received["value"].tolist()
+        taint = dict(zip(I, V))
+        return fp64_vector(list(taint), list(taint.values()))
+
+    def step(self, x, IT, TO):
+        """Move taint ``x`` one hop, from the outputs the txs of ``IT``
+        spend to the outputs those txs create."""
+        t = maximal_vector(FP64)
+        with semiring.PLUS_FIRST_FP64:
+            x.vxm(IT, out=t)
+        out = maximal_vector(FP64)
+        if not t:
+            return out
+        if self.model == "haircut":
+            f = maximal_vector(FP64)
+            t.emult(self.in_value, binaryop.DIV_FP64, out=f)
+            with semiring.PLUS_TIMES_FP64:
+                f.vxm(TO, out=out)
+        elif self.model == "poison":
+            with semiring.ANY_SECOND_FP64:
+                t.vxm(TO, out=out)
+        else:
+            out = self.fifo_step(x, t, IT, TO)
+        return out
+
+    def fifo_step(self, x, t, IT, TO):
+        txs = t.to_lists()[0]
+        I, T, V = select_ids(IT, txs, 1).to_lists()
+        I = np.array(I, dtype=np.uint64)
+        T = np.array(T, dtype=np.uint64)
+        order = np.lexsort((I, T))
+        I, T, V = I[order], T[order], np.array(V, dtype=np.float64)[order]
+        xi, xv = x.to_lists()
+        xi = np.array(xi, dtype=np.uint64)
+        k = np.minimum(np.searchsorted(xi, I), len(xi) - 1)
+        X = np.where(xi[k] == I, np.array(xv, dtype=np.float64)[k], 0.0)
+
+        Tt, O, W = select_ids(TO, txs).to_lists()
+        Tt = np.array(Tt, dtype=np.uint64)
+        O = np.array(O, dtype=np.uint64)
+        order = np.lexsort((O, Tt))
+        Tt, O, W = Tt[order], O[order], np.array(W, dtype=np.float64)[order]
+        taint = fifo(T, V, X, Tt, W)
+        keep = taint > 0
+        return fp64_vector(O[keep], taint[keep])
+
+    def trace(self, seed, hops=lib.GxB_INDEX_MAX, until=None):
+        """Follow the taint vector ``seed`` for at most ``hops`` txs, and
+        only through txs in blocks up to ``until`` if given.  Returns
+        the total taint of every output reached, including the seed."""
+        IT = self.chain.IT
+        if until is not None:
+            IT = select_range(IT, 0, block_range(0, until)[1], 1)
+        TO = self.chain.TO
+        total = seed.dup()
+        x = seed
+        for hop in range(hops):
+            x = self.step(x, IT, TO)
+            if not x:
+                break
+            total.eadd(x, binaryop.PLUS_FP64, out=total)
+        return total
+
+    def addresses(self, taint):
+        """The taint of outputs summed by the addresses they pay."""
+        a = maximal_vector(FP64)
+        with semiring.PLUS_FIRST_FP64:
+            taint.vxm(self.chain.OR, out=a)
+        return a
+
+    def __repr__(self):
+        return f"<Flow {self.model}>"
@@ -0,0 +1,296 @@
+"""Memory mapped dictionaries between ids and tx hashes or addresses.
+
+A dictionary is a directory of segments, one per import unit.  Each
+segment is a directory of flat files:
+
+    ids.npy        sorted ids
+    offsets.npy    offsets of each id's key in the heap, plus the end
+    heap.bin       the keys, utf-8 encoded, in id order
+    digests.npy    sorted 64 bit digests of the keys
+    positions.npy  the position in ``ids`` of each digest
+
+The arrays are opened with ``mmap`` and binary searched, keys are
+verified against the heap to rule out digest collisions.  Small
+segments, one per followed poll or import shard, are merged into one
+per month with ``merge`` so the number of open maps stays small.
+
+Digests are uniformly spread, so every segment could hold any key.
+Rather than searching each segment in turn, the digests of all of them
+are kept sorted together in an ``index`` directory:
+
+    digests.npy    sorted digests of every segment
+    segments.npy   the segment of each digest
+    positions.npy  the position in that segment's ``ids``
+    segments.json  the segments indexed, by name and stamp
+
+and a lookup is one binary search in the index plus one in each segment
+written since it was built.  ``reindex`` rebuilds it once an import or
+month is done.
+"""
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+INDEX = "index"
+
+
+def digest(key):
+    return np.uint64(
+        int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "little")
+    )
+
+
+def write_segment(path, pairs):
+    """Write ``(id, key)`` pairs as the segment ``path``, with no pairs
+    any segment there is removed and none is written."""
+    pairs = sorted(set(pairs))
+    path = Path(path)
+    if not pairs:
+        shutil.rmtree(path, ignore_errors=True)
+        return
+    tmp = temporary(path)
+
+    keys = [k.encode() for _, k in pairs]
+    offsets = np.zeros(len(keys) + 1, dtype=np.uint64)
+    offsets[1:] = np.cumsum([len(k) for k in keys])
+    digests = np.array([digest(k) for k in keys], dtype=np.uint64)
+    positions = np.argsort(digests, kind="stable").astype(np.uint64)
+
+    np.save(tmp / "ids.npy", np.array([i for i, _ in pairs], dtype=np.uint64))
+    np.save(tmp / "offsets.npy", offsets)
+    np.save(tmp / "digests.npy", digests[positions])
+    np.save(tmp / "positions.npy", positions)
+    with open(tmp / "heap.bin", "wb") as f:
+        f.write(b"".join(keys))
+
+    replace(tmp, path)
+
+
+def temporary(path):
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    return tmp
+
+
+def replace(tmp, path):
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+
+
+def write_index(path, segments):
+    """Write the digests of ``segments`` as one sorted index ``path``."""
+    path = Path(path)
+    tmp = temporary(path)
+    digests = np.concatenate([s.digests for s in segments])
+    owners = np.concatenate(
+        [np.full(len(s), i, dtype=np.uint32) for i, s in enumerate(segments)]
+    )
+    positions = np.concatenate([s.positions for s in segments])
+    # the digests are sorted runs, which a stable sort merges, and keys
+    # in more than one segment stay in segment order
+    order = np.argsort(digests, kind="stable")
+    np.save(tmp / "digests.npy", digests[order])
+    np.save(tmp / "segments.npy", owners[order])
+    np.save(tmp / "positions.npy", positions[order])
+    with open(tmp / "segments.json", "w") as f:
+        json.dump([[s.path.name, s.stamp] for s in segments], f)
+    replace(tmp, path)
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.ids = np.load(self.path / "ids.npy", mmap_mode="r")
+        self.offsets = np.load(self.path / "offsets.npy", mmap_mode="r")
+        self.digests = np.load(self.path / "digests.npy", mmap_mode="r")
+        self.positions = np.load(self.path / "positions.npy", mmap_mode="r")
+        heap = self.path / "heap.bin"
+        if heap.stat().st_size:
+            self.heap = np.memmap(heap, dtype=np.uint8, mode="r")
+        else:
+            self.heap = np.zeros(0, dtype=np.uint8)
+        self.first = int(self.ids[0])
+        self.last = int(self.ids[-1])
+        # a segment written again under the same name is a new directory
+        self.stamp = [self.path.stat().st_ino, len(self.ids)]
+
+    def key_at(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.heap[start:end].tobytes()
+
+    def id(self, key, d=None):
+        """The id of ``key``, which may be given encoded along with its
+        digest ``d`` when it is looked up in many segments."""
+        if isinstance(key, str):
+            key = key.encode()
+        if d is None:
+            d = digest(key)
+        lo = np.searchsorted(self.digests, d, "left")
+        hi = np.searchsorted(self.digests, d, "right")
+        for position in self.positions[lo:hi]:
+            if self.key_at(position) == key:
+                return int(self.ids[position])
+
+    def key(self, id):
+        if not self.first <= id <= self.last:
+            return
+        position = np.searchsorted(self.ids, np.uint64(id))
+        if position < len(self.ids) and self.ids[position] == id:
+            return self.key_at(position).decode()
+
+    def items(self):
+        for position in range(len(self.ids)):
+            yield int(self.ids[position]), self.key_at(position).decode()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"<Segment {self.path.name}: {len(self)} keys>"
+
+
+class Index:
+    """The sorted digests of ``segments``, see ``write_index``.  Segments
+    that were merged away or written again since are ``None`` and their
+    digests are skipped."""
+
+    def __init__(self, path, segments):
+        self.path = Path(path)
+        self.segments = segments
+        self.digests = np.load(self.path / "digests.npy", mmap_mode="r")
+        self.owners = np.load(self.path / "segments.npy", mmap_mode="r")
+        self.positions = np.load(self.path / "positions.npy", mmap_mode="r")
+
+    @staticmethod
+    def covers(path):
+        """The ``(name, stamp)`` of each segment the index at ``path``
+        was built from."""
+        with open(Path(path) / "segments.json") as f:
+            return [(name, stamp) for name, stamp in json.load(f)]
+
+    def id(self, key, d):
+        lo = np.searchsorted(self.digests, d, "left")
+        hi = np.searchsorted(self.digests, d, "right")
+        # newest segment first
+        for i in reversed(range(lo, hi)):
+            segment = self.segments[self.owners[i]]
+            if segment is None:
+                continue
+            position = self.positions[i]
+            if segment.key_at(position) == key:
+                return int(segment.ids[position])
+
+    def covers_same(self, segments):
+        return len(segments) == len(self.segments) and all(
+            a is b for a, b in zip(segments, self.segments)
+        )
+
+    def __repr__(self):
+        return f"<Index of {len(self.segments)} segments>"
+
+
+class IdDict:
+    """Segments of one kind of key, searched newest first.
+
+    Segments written by other processes are picked up by ``refresh``.
+    Keys are looked up in the segments written since the ``index`` was
+    built and then in the index.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.segments = []
+        self.index = None
+        self.unindexed = []
+        self.refresh()
+
+    def refresh(self):
+        if not self.path.exists():
+            self.segments = []
+            self.index = None
+            self.unindexed = []
+            return
+        opened = {s.path.name: s for s in self.segments}
+        self.segments = [
+            opened.get(p.name) or Segment(p)
+            for p in sorted(self.path.iterdir())
+            if p.is_dir() and not p.name.startswith(".") and p.name != INDEX
+        ]
+        self.index = self.open_index()
+        indexed = set(self.index.segments) if self.index else set()
+        self.unindexed = [s for s in self.segments if s not in indexed]
+
+    def open_index(self):
+        """The index, with the segments it covers that are no longer
+        there as they were left out."""
+        path = self.path / INDEX
+        if not path.exists():
+            return
+        segments = {s.path.name: s for s in self.segments}
+        covered = []
+        for name, stamp in Index.covers(path):
+            segment = segments.get(name)
+            covered.append(segment if segment and segment.stamp == stamp else None)
+        if self.index is not None and self.index.covers_same(covered):
+            return self.index
+        return Index(path, covered)
+
+    def reindex(self):
+        """Rebuild the index over every segment, if any is not in it."""
+        self.refresh()
+        stale = self.index is not None and None in self.index.segments
+        if not self.unindexed and not stale:
+            return
+        if self.segments:
+            write_index(self.path / INDEX, self.segments)
+        else:
+            shutil.rmtree(self.path / INDEX, ignore_errors=True)
+        self.refresh()
+
+    def write(self, name, pairs):
+        self.segments = [s for s in self.segments if s.path.name != name]
+        write_segment(self.path / name, pairs)
+        self.refresh()
+
+    def merge(self, name, names):
+        """Replace the segments ``names``, and ``name`` if there is one,
+        with a single segment ``name``."""
+        names = set(names) | {name}
+        merged = [s for s in self.segments if s.path.name in names]
+        if not [s for s in merged if s.path.name != name]:
+            return
+        self.write(name, [pair for s in merged for pair in s.items()])
+        for segment in merged:
+            if segment.path.name != name:
+                shutil.rmtree(segment.path, ignore_errors=True)
+        self.refresh()
+
+    def id(self, key):
+        key = key.encode()
+        d = digest(key)
+        for segment in reversed(self.unindexed):
+            id = segment.id(key, d)
+            if id is not None:
+                return id
+        if self.index is not None:
+            return self.index.id(key, d)
+
+    def key(self, id):
+        for segment in self.segments:
+            key = segment.key(id)
+            if key is not None:
+                return key
+
+    def __len__(self):
+        return sum(len(s) for s in self.segments)
+
+    def __repr__(self):
+        return (
+            f"<IdDict {self.path}: {len(self.segments)} segments, "
+            f"{len(self.unindexed)} not indexed>"
+        )
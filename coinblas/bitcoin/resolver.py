@@ -0,0 +1,79 @@
+from collections import defaultdict
+
+from coinblas.util import curse, grouper, LRUCache
+
+RESOLVER_CACHE_SIZE = 1 << 20
+BATCH_SIZE = 10000
+
+QUERIES = {
+    "tx": "SELECT t_id, t_hash FROM bitcoin.tx WHERE t_id = any(%s)",
+    "block": """
+        SELECT b_number, b_hash, b_timestamp
+        FROM bitcoin.base_block WHERE b_number = any(%s)
+    """,
+    "address": "SELECT a_id, a_address FROM bitcoin.address WHERE a_id = any(%s)",
+}
+
+# kinds that are looked up in the chain's id dictionaries before Postgres
+IDDICTS = {"tx": "tx_ids", "address": "address_ids"}
+
+
+class Resolver:
+    """Metadata for ids, fetched from Postgres in batches.
+
+    Ids that will be needed soon are queued with ``want``.  The first
+    ``get`` of a kind fetches it along with everything queued for that
+    kind, from the chain's id dictionaries on disk when they have it and
+    otherwise ``BATCH_SIZE`` ids per ``= any(%s)`` query, so iterating
+    over many objects costs a handful of queries instead of one each.
+    Results are kept in a cache of ``cache_size`` ids per kind.
+
+    Kinds are ``tx`` for tx hashes by tx id, ``block`` for block
+    ``(hash, timestamp)`` by block number and ``address`` for addresses
+    by address id.
+    """
+
+    def __init__(self, chain, cache_size=RESOLVER_CACHE_SIZE):
+        self.chain = chain
+        self.caches = {kind: LRUCache(cache_size) for kind in QUERIES}
+        self.pending = defaultdict(set)
+
+    def want(self, kind, ids):
+        cache = self.caches[kind]
+        self.pending[kind].update(int(i) for i in ids if i not in cache)
+
+    def fetch(self, kind):
+        cache = self.caches[kind]
+        ids = self.pending.pop(kind, set())
+        if kind in IDDICTS:
+            iddict = getattr(self.chain, IDDICTS[kind])
+            for i in list(ids):
+                key = iddict.key(i)
+                if key is not None:
+                    cache[i] = key
+                    ids.discard(i)
+        if ids:
+            self.query(kind, ids)
+
+    @curse
+    def query(self, curs, kind, ids):
+        cache = self.caches[kind]
+        for batch in grouper(ids, BATCH_SIZE):
+            batch = [i for i in batch if i is not None]
+            curs.execute(QUERIES[kind], (batch,))
+            found = {
+                r[0]: r[1] if len(r) == 2 else r[1:] for r in curs.fetchall()
+            }
+            for i in batch:
+                cache[i] = found.get(i)
+
+    def get(self, kind, id):
+        cache = self.caches[kind]
+        if id not in cache:
+            self.pending[kind].add(int(id))
+            self.fetch(kind)
+        return cache.get(id)
+
+    def __repr__(self):
+        sizes = ", ".join(f"{k}: {len(c)}" for k, c in self.caches.items())
+        return f"<Resolver {sizes}>"
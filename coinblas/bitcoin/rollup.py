@@ -0,0 +1,49 @@
+from pathlib import Path
+
+from .block import BlockGraph, SUFFIXES
+
+
+class Rollup(BlockGraph):
+    """Pre-merged incidence matrices for a contiguous run of blocks.
+
+    Rollups are named for the month ("2012-01") or year ("2012") they
+    cover and live in the ``rollup`` directory under the chain's block
+    path as ``{name}_{first}_{last}_{suffix}.ssb``.
+    """
+
+    def __init__(self, chain, name, first, last):
+        self.chain = chain
+        self.name = name
+        self.first = first
+        self.last = last
+
+    @classmethod
+    def from_datafile(cls, chain, datafile):
+        name, first, last, _ = Path(datafile).stem.rsplit("_", 3)
+        return cls(chain, name, int(first), int(last))
+
+    @property
+    def span(self):
+        return self.first, self.last
+
+    def datafile(self, suffix, path=None):
+        path = Path(path or self.chain.block_path) / "rollup"
+        return path / f"{self.name}_{self.first}_{self.last}_{suffix}.ssb"
+
+    def write_block_files(self, path=None):
+        # BT is written last, rollups are discovered by their BT file so
+        # a partially written rollup is never picked up by a loader.
+        for suffix in reversed(SUFFIXES):
+            datafile = self.datafile(suffix, path)
+            datafile.parent.mkdir(parents=True, exist_ok=True)
+            getattr(self, suffix).to_binfile(bytes(datafile))
+
+    def remove_block_files(self, path=None):
+        for suffix in SUFFIXES:
+            self.datafile(suffix, path).unlink(missing_ok=True)
+
+    def __len__(self):
+        return self.last - self.first + 1
+
+    def __repr__(self):
+        return f"<Rollup {self.name}: {self.first} to {self.last}>"
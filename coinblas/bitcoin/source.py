@@ -0,0 +1,269 @@
+"""Row sources that Chain imports blocks and transactions from.
+
+A source yields plain mappings.  Block rows have ``number``, ``hash``,
+``timestamp`` and ``timestamp_month``; transaction rows have the
+columns of the BigQuery query below, one row per input and output pair,
+ordered by block number, tx hash, input index and output index.
+"""
+import json
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+import numpy as np
+from google.cloud import bigquery
+
+
+class Source:
+    """Base class for row sources.
+
+    ``parallel`` is false for sources that must be read by a single
+    process, in order.  ``shardable`` is false for sources that cost as
+    much to read a few blocks of a month from as the whole month.  Their
+    months are fetched once and the rows shared out between shards.
+    """
+
+    parallel = True
+    shardable = True
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}>"
+
+    def blocks(self, after=None):
+        """Rows for every block, or every block numbered above ``after``."""
+        raise NotImplementedError
+
+    def transactions(self, month, start=None, end=None):
+        """Rows for the transactions of ``month``, optionally only those
+        in blocks ``start`` to ``end`` inclusive."""
+        raise NotImplementedError
+
+
+def rows_in_blocks(start=None, end=None, column="block_number"):
+    clause = ""
+    if start is not None:
+        clause += f" AND {column} >= {int(start)}"
+    if end is not None:
+        clause += f" AND {column} <= {int(end)}"
+    return clause
+
+
+class BigQuerySource(Source):
+    """The ``crypto_bitcoin`` public dataset on Google BigQuery.
+
+    One client is opened per process on first use, and is not pickled
+    with the source.  The transactions query numbers every tx in the
+    table to resolve spent outputs, so it scans the whole table however
+    few blocks it returns, and is fetched a whole month at a time.
+    """
+
+    client = None
+    shardable = False
+
+    def query(self, query):
+        if self.client is None:
+            self.client = bigquery.Client()
+        return self.client.query(query)
+
+    def __getstate__(self):
+        state = dict(vars(self))
+        state.pop("client", None)
+        return state
+
+    def blocks(self, after=None):
+        where = "" if after is None else f"WHERE number > {int(after)}"
+        return self.query(
+            f"""
+        SELECT number, `hash`, timestamp, timestamp_month
+        FROM `bigquery-public-data.crypto_bitcoin.blocks`
+        {where}
+        ORDER BY number;
+        """
+        )
+
+    def transactions(self, month, start=None, end=None):
+        return self.query(
+            f"""
+        WITH TIDS AS (
+            SELECT
+                block_number,
+                block_hash,
+                block_timestamp,
+                block_timestamp_month, `hash`, inputs, outputs,
+                (block_number << 32) + (ROW_NUMBER()
+                    OVER(PARTITION BY block_number ORDER BY block_number, `hash`) << 16) AS t_id
+        FROM `bigquery-public-data.crypto_bitcoin.transactions`
+        ORDER BY block_number, `hash`)
+
+        SELECT
+            t.t_id as t_id,
+            t.block_number as b_number,
+            t.block_hash as b_hash,
+            t.block_timestamp as b_timestamp,
+            t.block_timestamp_month as b_timestamp_month,
+            t.`hash` as t_hash,
+            spents.t_id as i_spent_tid,
+            i.spent_output_index as i_spent_index,
+            i.addresses as i_addresses,
+            i.value as i_value,
+            i.index as i_index,
+            o.index as o_index,
+            o.addresses as o_addresses,
+            o.value as o_value
+        FROM tids t LEFT JOIN UNNEST(inputs) as i,
+        UNNEST(outputs) as o
+        LEFT JOIN tids spents on (i.spent_transaction_hash = spents.`hash`)
+        WHERE t.block_timestamp_month = '{month}'
+        {rows_in_blocks(start, end, "t.block_number")}
+        ORDER BY t.block_number, t.`hash`, i.index, o.index
+        """
+        )
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def write_columns(path, rows, key="b_number"):
+    """Save rows, sorted by the block number column ``key``, as the
+    directory ``path`` with files per column:
+
+        columns.json       the column names and kinds, and ``key``
+        blocks.npy         the block numbers, and in bounds.npy the
+                           first row of each and the number of rows
+        NAME.npy           an integer column, with NAME.null.npy
+                           marking its ``None`` rows if it has any
+        NAME.heap          any other column pickled block by block,
+                           with the offset of each in NAME.offsets.npy
+
+    so that ``read_columns`` can map the arrays and read only the rows
+    of a range of blocks.
+    """
+    rows = [dict(r.items()) for r in rows]
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    numbers = np.array([r[key] for r in rows], dtype=np.int64)
+    blocks, starts = np.unique(numbers, return_index=True)
+    bounds = np.append(starts, len(rows)).astype(np.int64)
+    np.save(tmp / "blocks.npy", blocks)
+    np.save(tmp / "bounds.npy", bounds)
+
+    columns = []
+    for name in list(rows[0]) if rows else []:
+        values = [r[name] for r in rows]
+        if all(v is None or is_int(v) for v in values):
+            nulls = np.array([v is None for v in values])
+            np.save(
+                tmp / f"{name}.npy",
+                np.array([v or 0 for v in values], dtype=np.int64),
+            )
+            kind = "int"
+            if nulls.any():
+                np.save(tmp / f"{name}.null.npy", nulls)
+                kind = "nullable"
+        else:
+            chunks = [
+                pickle.dumps(values[a:b], pickle.HIGHEST_PROTOCOL)
+                for a, b in zip(bounds[:-1], bounds[1:])
+            ]
+            offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(c) for c in chunks])
+            np.save(tmp / f"{name}.offsets.npy", offsets)
+            with open(tmp / f"{name}.heap", "wb") as f:
+                f.write(b"".join(chunks))
+            kind = "object"
+        columns.append([name, kind])
+    with open(tmp / "columns.json", "w") as f:
+        json.dump(dict(key=key, columns=columns), f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+    return rows
+
+
+def read_columns(path, start=None, end=None):
+    """The rows saved by ``write_columns`` under ``path``, or only those
+    in blocks ``start`` to ``end`` inclusive."""
+    path = Path(path)
+    with open(path / "columns.json") as f:
+        columns = json.load(f)["columns"]
+    blocks = np.load(path / "blocks.npy", mmap_mode="r")
+    bounds = np.load(path / "bounds.npy", mmap_mode="r")
+    lo = 0 if start is None else int(np.searchsorted(blocks, start, "left"))
+    hi = len(blocks) if end is None else int(np.searchsorted(blocks, end, "right"))
+    first, last = int(bounds[lo]), int(bounds[hi])
+
+    data = {}
+    for name, kind in columns:
+        if kind == "object":
+            offsets = np.load(path / f"{name}.offsets.npy", mmap_mode="r")
+            offsets = [int(o) for o in offsets[lo : hi + 1]]
+            with open(path / f"{name}.heap", "rb") as f:
+                f.seek(offsets[0])
+                heap = f.read(offsets[-1] - offsets[0])
+            values = []
+            for a, b in zip(offsets[:-1], offsets[1:]):
+                values += pickle.loads(heap[a - offsets[0] : b - offsets[0]])
+        else:
+            values = np.load(path / f"{name}.npy", mmap_mode="r")[first:last].tolist()
+            if kind == "nullable":
+                nulls = np.load(path / f"{name}.null.npy", mmap_mode="r")
+                values = [None if n else v for v, n in zip(values, nulls[first:last])]
+        data[name] = values
+    return [dict(zip(data, values)) for values in zip(*data.values())]
+
+
+def recording(path, month, start=None, end=None):
+    if start is None and end is None:
+        return Path(path) / str(month)
+    return Path(path) / f"{month}_{start}_{end}"
+
+
+class RecordSource(Source):
+    """Pass rows through from ``source``, saving them under ``path`` in
+    the columnar format of ``write_columns`` that ``ReplaySource`` can
+    play back."""
+
+    def __init__(self, source, path):
+        self.source = source
+        self.path = Path(path)
+        self.parallel = source.parallel
+        self.shardable = source.shardable
+
+    def blocks(self, after=None):
+        path = self.path / "blocks"
+        rows = [dict(r.items()) for r in self.source.blocks(after)]
+        if after is not None and path.exists():
+            # a poll, keep the blocks recorded before it
+            kept = read_columns(path, end=after)
+            write_columns(path, kept + rows, key="number")
+        else:
+            write_columns(path, rows, key="number")
+        return rows
+
+    def transactions(self, month, start=None, end=None):
+        return write_columns(
+            recording(self.path, month, start, end),
+            self.source.transactions(month, start, end),
+        )
+
+
+class ReplaySource(Source):
+    """Rows recorded by ``RecordSource``, read back from local files."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def blocks(self, after=None):
+        start = None if after is None else after + 1
+        return read_columns(self.path / "blocks", start)
+
+    def transactions(self, month, start=None, end=None):
+        path = recording(self.path, month, start, end)
+        if path.exists():
+            return read_columns(path)
+        return read_columns(recording(self.path, month), start, end)
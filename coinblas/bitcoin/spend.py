@@ -19,7 +19,7 @@ class Spend:
 
         r = self.chain.OR[self.id, :]
         if not r.nvals:
-            r = self.chain.SI[:, self.id]
+            r = self.chain.SI_T[self.id, :]
             if not r.nvals:
                 return []
         return [Address(self.chain, a_id) for a_id, _ in r]
@@ -0,0 +1,156 @@
+"""Synthetic, BigQuery shaped chains for benchmarks and tests."""
+import hashlib
+import random
+from datetime import datetime, timedelta, timezone
+
+from .source import Source
+
+BLOCK_INTERVAL = timedelta(minutes=10)
+REWARD = 50 * 100000000
+
+
+class SyntheticSource(Source):
+    """A reproducible random chain of ``blocks`` blocks.
+
+    Every block has a coinbase and up to ``txs_per_block - 1``
+    transactions spending ``fan_in`` unspent outputs of earlier blocks
+    into ``fan_out`` new outputs.  Each output pays an existing address with
+    probability ``address_reuse`` and a fresh one otherwise.  Ids follow
+    the same blocktime scheme as BigQuery: txs are numbered by hash order
+    within their block.
+    """
+
+    def __init__(
+        self,
+        blocks=100,
+        txs_per_block=100,
+        fan_in=2,
+        fan_out=2,
+        address_reuse=0.5,
+        seed=0,
+        first=0,
+        start_time=datetime(2012, 1, 1, tzinfo=timezone.utc),
+    ):
+        self.nblocks = blocks
+        self.txs_per_block = txs_per_block
+        self.fan_in = fan_in
+        self.fan_out = fan_out
+        self.address_reuse = address_reuse
+        self.seed = seed
+        self.first = first
+        self.start_time = start_time
+
+    def __repr__(self):
+        return (
+            f"<SyntheticSource {self.nblocks} blocks of {self.txs_per_block} txs, "
+            f"fan in {self.fan_in} out {self.fan_out}>"
+        )
+
+    def block_hash(self, number):
+        return hashlib.sha256(f"{self.seed}:block:{number}".encode()).hexdigest()
+
+    def timestamp(self, number):
+        return self.start_time + (number - self.first) * BLOCK_INTERVAL
+
+    def blocks(self, after=None):
+        for number in range(self.first, self.first + self.nblocks):
+            if after is not None and number <= after:
+                continue
+            timestamp = self.timestamp(number)
+            yield dict(
+                number=number,
+                hash=self.block_hash(number),
+                timestamp=timestamp,
+                timestamp_month=timestamp.date().replace(day=1),
+            )
+
+    def transactions(self, month, start=None, end=None):
+        month = str(month)
+        for number, rows in self.generate():
+            if start is not None and number < start:
+                continue
+            if end is not None and number > end:
+                break
+            if str(self.timestamp(number).date().replace(day=1)) == month:
+                yield from rows
+
+    def generate(self):
+        """Yield ``(number, rows)`` for every block in order."""
+        rnd = random.Random(self.seed)
+        addresses = []
+        unspent = []
+
+        def address():
+            if addresses and rnd.random() < self.address_reuse:
+                return rnd.choice(addresses)
+            a = f"1syn{self.seed}x{len(addresses)}"
+            addresses.append(a)
+            return a
+
+        for number in range(self.first, self.first + self.nblocks):
+            timestamp = self.timestamp(number)
+            base = dict(
+                b_number=number,
+                b_hash=self.block_hash(number),
+                b_timestamp=timestamp,
+                b_timestamp_month=timestamp.date().replace(day=1),
+            )
+            txs = []
+            for index in range(self.txs_per_block):
+                t_hash = hashlib.sha256(
+                    f"{self.seed}:tx:{number}:{index}".encode()
+                ).hexdigest()
+                if index == 0:
+                    inputs = [None]
+                    value = REWARD
+                elif not unspent:
+                    break
+                else:
+                    inputs = [
+                        unspent.pop(rnd.randrange(len(unspent)))
+                        for _ in range(min(self.fan_in, len(unspent)))
+                    ]
+                    value = sum(i[2] for i in inputs)
+                share = value // self.fan_out
+                outputs = [
+                    (share + (value - share * self.fan_out if o == 0 else 0), address())
+                    for o in range(self.fan_out)
+                ]
+                txs.append((t_hash, inputs, outputs))
+
+            rows = []
+            created = []
+            for row, (t_hash, inputs, outputs) in enumerate(sorted(txs), 1):
+                t_id = (number << 32) + (row << 16)
+                for i_index, i in enumerate(inputs):
+                    spent = dict(
+                        i_spent_tid=None,
+                        i_spent_index=None,
+                        i_addresses=[],
+                        i_value=None,
+                        i_index=None,
+                    )
+                    if i is not None:
+                        spent = dict(
+                            i_spent_tid=i[0],
+                            i_spent_index=i[1],
+                            i_addresses=[i[3]],
+                            i_value=i[2],
+                            i_index=i_index,
+                        )
+                    for o_index, (o_value, o_address) in enumerate(outputs):
+                        rows.append(
+                            dict(
+                                base,
+                                t_id=t_id,
+                                t_hash=t_hash,
+                                o_index=o_index,
+                                o_addresses=[o_address],
+                                o_value=o_value,
+                                **spent,
+                            )
+                        )
+                for o_index, (o_value, o_address) in enumerate(outputs):
+                    created.append((t_id, o_index, o_value, o_address))
+            unspent.extend(created)
+            yield number, rows
@@ -2,9 +2,8 @@ from collections import defaultdict
 
 from coinblas.util import (
     btc,
-    curse,
     get_block_number,
-    query,
+    get_tx_id,
     lazy,
 )
 from .spend import Spend
@@ -26,16 +25,8 @@ class Tx:
         self.pending_output_addresses = defaultdict(list)
 
     @lazy
-    @curse
-    @query
-    def hash(self, curs):
-        """
-        SELECT t_hash FROM bitcoin.tx WHERE t_id = {self.id}
-        """
-        h = curs.fetchone()
-        if h is None:
-            return None
-        return h[0]
+    def hash(self):
+        return self.chain.resolver.get("tx", self.id)
 
     @property
     def block_number(self):
@@ -47,7 +38,7 @@ class Tx:
 
     @lazy
     def input_vector(self):
-        return self.chain.IT[:, self.id]
+        return self.chain.IT_T[self.id, :]
 
     @lazy
     def output_vector(self):
@@ -55,7 +46,9 @@ class Tx:
 
     @property
     def inputs(self):
-        for i, v in self.input_vector:
+        inputs = list(self.input_vector)
+        self.chain.resolver.want("tx", (get_tx_id(i) for i, _ in inputs))
+        for i, v in inputs:
             yield Spend(self.chain, i, v)
 
     @property
@@ -69,7 +62,9 @@ class Tx:
         r += f"Block: {self.block_number}\n"
 
         inputs = list(self.inputs)
-        outputs = self.outputs
+        outputs = list(self.outputs)
+        spent = self.chain.spent_txs([o.id for o in outputs])
+        self.chain.resolver.want("tx", spent["tx"])
 
         if len(inputs) == 1 and inputs[0].coinbase:
             r += "Coinbase Transaction\n"
@@ -0,0 +1,233 @@
+"""Timing spans, counters and memory use of the hot paths.
+
+``metrics`` is a process wide registry.  Code is instrumented with
+
+    with metrics.span("build_block_graph"):
+        ...
+    metrics.count("rows", len(group))
+
+and the totals can be written as JSON lines or in the Prometheus text
+format.  Setting ``metrics.trace`` to an open file also writes every
+finished span to it as a JSON line as it happens.  Worker processes
+send their ``snapshot`` back to be added up with ``merge``.
+"""
+import json
+import os
+import re
+import resource
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from functools import wraps
+from threading import Lock
+from time import perf_counter, time
+
+
+def rss():
+    """Resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = Lock()
+        self.trace = None
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = defaultdict(int)
+            self.seconds = defaultdict(float)
+            self.counters = defaultdict(int)
+
+    @contextmanager
+    def span(self, name):
+        tic = perf_counter()
+        try:
+            yield
+        finally:
+            took = perf_counter() - tic
+            with self.lock:
+                self.calls[name] += 1
+                self.seconds[name] += took
+                if self.trace is not None:
+                    event = dict(span=name, seconds=took, time=time(), pid=os.getpid())
+                    self.trace.write(json.dumps(event) + "\n")
+
+    def timed(self, name):
+        """Decorate a function to run in a span."""
+
+        def decorator(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return f(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def iterate(self, name, iterable):
+        """Yield from ``iterable``, adding the time spent waiting for
+        items to the span ``name`` with one call per item."""
+        it = iter(iterable)
+        calls = 0
+        seconds = 0.0
+        try:
+            while True:
+                tic = perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += perf_counter() - tic
+                calls += 1
+                yield item
+        finally:
+            with self.lock:
+                self.calls[name] += calls
+                self.seconds[name] += seconds
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def merge(self, snapshot):
+        """Add the spans and counters of a ``snapshot``, usually taken in
+        a worker process, to the totals."""
+        with self.lock:
+            for name, span in snapshot["spans"].items():
+                self.calls[name] += span["calls"]
+                self.seconds[name] += span["seconds"]
+            for name, value in snapshot["counters"].items():
+                self.counters[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(
+                pid=os.getpid(),
+                time=time(),
+                rss=rss(),
+                peak_rss=peak_rss(),
+                spans={
+                    n: dict(calls=self.calls[n], seconds=self.seconds[n])
+                    for n in sorted(self.calls)
+                },
+                counters=dict(sorted(self.counters.items())),
+            )
+
+    def to_json_lines(self):
+        s = self.snapshot()
+        base = dict(pid=s["pid"], time=s["time"])
+        lines = [dict(base, gauge="rss", value=s["rss"])]
+        lines.append(dict(base, gauge="peak_rss", value=s["peak_rss"]))
+        for name, span in s["spans"].items():
+            lines.append(dict(base, span=name, **span))
+        for name, value in s["counters"].items():
+            lines.append(dict(base, counter=name, value=value))
+        return "".join(json.dumps(line) + "\n" for line in lines)
+
+    def to_prometheus(self):
+        s = self.snapshot()
+        lines = [
+            "# TYPE coinblas_span_calls_total counter",
+            *(
+                f'coinblas_span_calls_total{{span="{n}"}} {v["calls"]}'
+                for n, v in s["spans"].items()
+            ),
+            "# TYPE coinblas_span_seconds_total counter",
+            *(
+                f'coinblas_span_seconds_total{{span="{n}"}} {v["seconds"]:.6f}'
+                for n, v in s["spans"].items()
+            ),
+        ]
+        for name, value in s["counters"].items():
+            name = f"coinblas_{metric_name(name)}_total"
+            lines += [f"# TYPE {name} counter", f"{name} {value}"]
+        lines += [
+            "# TYPE coinblas_rss_bytes gauge",
+            f"coinblas_rss_bytes {s['rss']}",
+            "# TYPE coinblas_peak_rss_bytes gauge",
+            f"coinblas_peak_rss_bytes {s['peak_rss']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the totals to ``path``, in the Prometheus text format if
+        it ends in ``.prom`` and as JSON lines otherwise."""
+        path = str(path)
+        out = self.to_prometheus() if path.endswith(".prom") else self.to_json_lines()
+        with open(path, "w") as f:
+            f.write(out)
+
+    def report(self):
+        """A table of spans, slowest first, and counters."""
+        s = self.snapshot()
+        lines = [f"{'span':<40} {'calls':>10} {'seconds':>12} {'ms/call':>10}"]
+        for name, span in sorted(s["spans"].items(), key=lambda i: -i[1]["seconds"]):
+            per = 1000 * span["seconds"] / max(span["calls"], 1)
+            lines.append(
+                f"{name:<40} {span['calls']:>10} {span['seconds']:>12.3f} {per:>10.3f}"
+            )
+        lines.append("")
+        for name, value in s["counters"].items():
+            lines.append(f"{name:<40} {value:>23}")
+        lines.append(f"{'rss':<40} {s['rss']:>23}")
+        lines.append(f"{'peak_rss':<40} {s['peak_rss']:>23}")
+        return "\n".join(lines)
+
+
+class Progress:
+    """Rates and time left for ``total`` units of work done in pieces.
+
+    ``update`` adds finished units and any other counts, like txs, that
+    are reported as rates alongside them.
+    """
+
+    def __init__(self, total, unit="blocks"):
+        self.total = total
+        self.unit = unit
+        self.done = 0
+        self.counts = defaultdict(int)
+        self.start = perf_counter()
+
+    def update(self, done, **counts):
+        self.done += done
+        for name, n in counts.items():
+            self.counts[name] += n
+
+    @property
+    def elapsed(self):
+        return max(perf_counter() - self.start, 1e-9)
+
+    @property
+    def eta(self):
+        """Seconds left at the rate so far, ``None`` before any progress."""
+        if not self.done:
+            return None
+        return (self.total - self.done) * self.elapsed / self.done
+
+    def __str__(self):
+        rates = ", ".join(
+            f"{n / self.elapsed:.1f} {name}/s"
+            for name, n in [(self.unit, self.done), *self.counts.items()]
+        )
+        eta = self.eta
+        eta = "unknown" if eta is None else timedelta(seconds=round(eta))
+        return f"{self.done}/{self.total} {self.unit}, {rates}, ETA {eta}"
+
+
+metrics = Metrics()
@@ -1,7 +1,11 @@
+from collections import OrderedDict, defaultdict
+from io import StringIO
 from itertools import zip_longest
+from queue import Empty, Full, Queue
+from threading import Event, RLock, Thread
 from functools import wraps
 from textwrap import dedent
-from pygraphblas import Matrix, Vector
+from pygraphblas import Matrix, Vector, UINT64, binaryop, descriptor, semiring
 from lazy_property import LazyWritableProperty as lazy
 
 GxB_INDEX_MAX = 1 << 60
@@ -25,10 +29,157 @@ def grouper(iterable, n, fillvalue=None):
     return zip_longest(*args, fillvalue=fillvalue)
 
 
+_done = object()
+
+
+def pipeline(items, *stages, maxsize=8):
+    """Run ``items`` through ``stages``, each stage on its own thread.
+
+    Stages are joined by queues of at most ``maxsize`` items so a slow
+    stage holds back the ones before it.  Yields the results of the
+    last stage in order and re-raises the first error of any stage.
+    If the caller stops early, by an error, ``break`` or dropping the
+    generator, the stages finish the items they are on and exit.
+    """
+    queues = [Queue(maxsize) for _ in range(len(stages) + 1)]
+    errors = []
+    stopped = Event()
+
+    # waits are cut into short timeouts so that threads blocked on a
+    # full or empty queue notice when the caller has stopped
+    def put(q, item):
+        while not stopped.is_set():
+            try:
+                return q.put(item, timeout=0.1)
+            except Full:
+                pass
+
+    def get(q):
+        while not stopped.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except Empty:
+                pass
+        return _done
+
+    def feed():
+        try:
+            for item in items:
+                if errors or stopped.is_set():
+                    break
+                put(queues[0], item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            put(queues[0], _done)
+
+    def work(stage, inq, outq):
+        try:
+            item = get(inq)
+            while item is not _done:
+                put(outq, stage(item))
+                item = get(inq)
+        except BaseException as e:
+            errors.append(e)
+            while get(inq) is not _done:
+                pass
+        finally:
+            put(outq, _done)
+
+    threads = [Thread(target=feed, daemon=True)]
+    for stage, inq, outq in zip(stages, queues, queues[1:]):
+        threads.append(Thread(target=work, args=(stage, inq, outq), daemon=True))
+    for t in threads:
+        t.start()
+
+    try:
+        result = queues[-1].get()
+        while result is not _done:
+            yield result
+            result = queues[-1].get()
+    finally:
+        stopped.set()
+        for t in threads:
+            t.join()
+    if errors:
+        raise errors[0]
+
+
 def maximal_matrix(T):
     return Matrix.sparse(T, GxB_INDEX_MAX, GxB_INDEX_MAX)
 
 
+def build_matrix(T, I, J, V, dup_op=binaryop.SECOND):
+    """Build a maximal matrix in one call from coordinate lists,
+    combining duplicate entries with ``dup_op``."""
+    m = maximal_matrix(T)
+    if I:
+        m.build(I, J, V, dup_op=dup_op)
+    return m
+
+
+def block_range(first, last):
+    """The half open range of ids of blocks ``first`` to ``last``
+    inclusive, which holds the ids of their txs and outputs."""
+    return first << 32, (last + 1) << 32
+
+
+def present(M, axis=0):
+    """The indices of the non-empty rows of ``M``, or of its columns
+    for ``axis=1``."""
+    if axis:
+        return M.reduce_vector(desc=descriptor.T0).to_lists()[0]
+    return M.reduce_vector().to_lists()[0]
+
+
+def select_ids(M, ids, axis=0):
+    """The rows ``ids`` of ``M``, or its columns for ``axis=1``, keeping
+    their indices, in one ``mxm`` with a diagonal selector."""
+    ids = sorted({int(i) for i in ids})
+    D = build_matrix(UINT64, ids, ids, [1] * len(ids))
+    if axis:
+        with semiring.ANY_FIRST_UINT64:
+            return M @ D
+    with semiring.ANY_SECOND_UINT64:
+        return D @ M
+
+
+def range_index(start, end, axis):
+    # GraphBLAS ranges include their end
+    span = slice(start, end - 1)
+    return (slice(None), span) if axis else (span, slice(None))
+
+
+def select_range(M, start, end, axis=0):
+    """The entries of ``M`` with a row index in ``[start, end)``, or a
+    column index for ``axis=1``, keeping their indices.  The range is
+    extracted and assigned back in place as a ``GxB_RANGE``."""
+    out = Matrix.sparse(M.type, M.nrows, M.ncols)
+    if start < end:
+        index = range_index(start, end, axis)
+        out[index] = M[index]
+    return out
+
+
+def drop_range(M, start, end, axis=0):
+    """The entries of ``M`` with a row index outside ``[start, end)``,
+    or a column index for ``axis=1``, by assigning an empty matrix over
+    the range of a copy."""
+    out = M.dup()
+    if start < end:
+        shape = (M.nrows, end - start) if axis else (end - start, M.ncols)
+        out[range_index(start, end, axis)] = Matrix.sparse(M.type, *shape)
+    return out
+
+
+def difference(A, B):
+    """The entries of ``A`` where ``B`` has none."""
+    out = Matrix.sparse(A.type, A.nrows, A.ncols)
+    empty = Matrix.sparse(A.type, A.nrows, A.ncols)
+    A.eadd(empty, binaryop.FIRST, out=out, mask=B, desc=descriptor.RSC)
+    return out
+
+
 def maximal_vector(T):
     return Vector.sparse(T, GxB_INDEX_MAX)
 
@@ -37,6 +188,24 @@ def btc(value):
     return float(value / 100000000)
 
 
+def copy_value(value):
+    if value is None:
+        return r"\N"
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+    )
+
+
+def copy_rows(curs, table, columns, rows):
+    """Stream ``rows`` into ``table`` with ``COPY FROM STDIN``."""
+    buf = StringIO()
+    for row in rows:
+        buf.write("\t".join(map(copy_value, row)))
+        buf.write("\n")
+    buf.seek(0)
+    curs.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buf)
+
+
 def query(f):
     d = dedent(f.__doc__.split("\n", 1)[1])
     doc_query = (
@@ -67,6 +236,149 @@ def curse(func):
     return _decorator
 
 
+def loaded(obj, name):
+    """Whether the lazy or cached property ``name`` of ``obj`` has a
+    value."""
+    if isinstance(getattr(type(obj), name, None), cached):
+        return name in obj.matrix_cache
+    # LazyWritableProperty caches values in the instance as "_name"
+    return f"_{name}" in vars(obj)
+
+
+def unload(obj, name):
+    """Drop the value of a lazy or cached property so it is computed
+    again on next access."""
+    if isinstance(getattr(type(obj), name, None), cached):
+        obj.matrix_cache.drop(name)
+    else:
+        vars(obj).pop(f"_{name}", None)
+
+
 class Object:
     def __init__(self, d):
         self.__dict__ = dict(d)
+
+
+class LRUCache(OrderedDict):
+    """Mapping that drops its least recently used items beyond ``maxsize``."""
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+def matrix_bytes(m):
+    """Estimate the memory held by ``m``: a row index, a column index
+    and a value for every entry."""
+    return 24 * m.nvals
+
+
+class MatrixCache:
+    """Matrices by name, the least recently used are dropped while
+    they take more than ``budget`` bytes.  With no budget nothing is
+    ever dropped."""
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.matrices = OrderedDict()
+        self.lock = RLock()
+
+    def get(self, name, build):
+        with self.lock:
+            if name in self.matrices:
+                self.matrices.move_to_end(name)
+                return self.matrices[name]
+        m = build()
+        self.put(name, m)
+        return m
+
+    def put(self, name, m):
+        with self.lock:
+            self.matrices[name] = m
+            self.matrices.move_to_end(name)
+            self.evict(keep=name)
+
+    def evict(self, keep=None):
+        if self.budget is None:
+            return
+        with self.lock:
+            while self.nbytes > self.budget:
+                cold = next((n for n in self.matrices if n != keep), None)
+                if cold is None:
+                    break
+                del self.matrices[cold]
+
+    def drop(self, name):
+        with self.lock:
+            self.matrices.pop(name, None)
+
+    def clear(self):
+        with self.lock:
+            self.matrices.clear()
+
+    @property
+    def nbytes(self):
+        return sum(matrix_bytes(m) for m in list(self.matrices.values()))
+
+    def __contains__(self, name):
+        return name in self.matrices
+
+    def __len__(self):
+        return len(self.matrices)
+
+    def __repr__(self):
+        return (
+            f"<MatrixCache {len(self)} matrices, {self.nbytes / 1e9:.2f} GB "
+            f"of {'unlimited' if self.budget is None else self.budget / 1e9}>"
+        )
+
+
+class cached:
+    """A lazy property whose value is kept in the instance's
+    ``matrix_cache``, so it can be dropped to save memory and is then
+    computed again on next access."""
+
+    def __init__(self, method):
+        self.method = method
+        self.name = method.__name__
+        self.__doc__ = method.__doc__
+
+    def __get__(self, obj, owner):
+        if obj is None:
+            return self
+        return obj.matrix_cache.get(self.name, lambda: self.method(obj))
+
+    def __set__(self, obj, value):
+        obj.matrix_cache.put(self.name, value)
+
+
+class CopyBuffer:
+    """Rows collected across many blocks and copied in one batch per table."""
+
+    def __init__(self):
+        self.tables = defaultdict(list)
+        self.size = 0
+
+    def add(self, table, columns, rows):
+        self.tables[(table, columns)].extend(rows)
+        self.size += len(rows)
+
+    def flush(self, curs):
+        for (table, columns), rows in self.tables.items():
+            copy_rows(curs, table, columns, rows)
+        self.tables.clear()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
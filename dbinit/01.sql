@@ -146,4 +146,61 @@ BEGIN
 END;
 $$;
 
+CREATE OR REPLACE PROCEDURE bitcoin.extend_month(timestamp_month date)
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    min_id bigint;
+    max_id bigint;
+    name text = replace(timestamp_month::text, '-', '_');
+    attached boolean;
+
+BEGIN
+    IF to_regclass(format('bitcoin.%I', 'base_tx_' || name)) IS NULL THEN
+        CALL bitcoin.create_month(timestamp_month);
+        CALL bitcoin.index_and_attach(timestamp_month);
+        RETURN;
+    END IF;
+
+    SELECT min(b_number), max(b_number)
+    INTO min_id, max_id
+    FROM bitcoin.base_block
+    WHERE b_timestamp_month = timestamp_month;
+
+    min_id = min_id << 32;
+    max_id = ((max_id + 1) << 32) - 1;
+
+    SELECT EXISTS (
+        SELECT FROM pg_inherits
+        WHERE inhrelid = format('bitcoin.%I', 'base_tx_' || name)::regclass)
+    INTO attached;
+
+    IF attached THEN
+        EXECUTE format($i$
+            ALTER TABLE bitcoin.base_tx
+                DETACH PARTITION bitcoin."base_tx_%1$s";
+        $i$, name);
+    END IF;
+
+    EXECUTE format($i$
+        ALTER TABLE bitcoin."base_tx_%1$s"
+            DROP CONSTRAINT IF EXISTS "base_tx_%1$s_t_id_check";
+
+        ALTER TABLE bitcoin."base_tx_%1$s"
+            ADD CONSTRAINT "base_tx_%1$s_t_id_check"
+            CHECK (t_id >= %2$L AND t_id < %3$L );
+
+        $i$, name, min_id, max_id);
+
+    -- Indexes of the partition are attached back with it
+    IF attached THEN
+        EXECUTE format($i$
+            ALTER TABLE bitcoin.base_tx
+                ATTACH PARTITION bitcoin."base_tx_%1$s"
+            FOR VALUES FROM (%2$L) TO (%3$L);
+        $i$, name, min_id, max_id);
+    END IF;
+END;
+$$;
+
 COMMIT;
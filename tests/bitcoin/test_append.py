@@ -0,0 +1,155 @@
+from datetime import date
+
+import pytest
+from pygraphblas import UINT64, binaryop
+
+from coinblas.bitcoin import Block, Chain
+from coinblas.bitcoin.block import SUFFIXES
+from coinblas.util import build_matrix
+
+# blocks of txs, each a list of spent (block, tx row, output index)
+# and a list of (address id, value) outputs, coinbases spend nothing
+BLOCKS = {
+    0: [([], [(1, 50), (2, 50)])],
+    1: [([], [(3, 50)]), ([(0, 1, 0)], [(2, 20), (4, 30)])],
+    2: [([], [(1, 50)]), ([(1, 2, 0), (0, 1, 1)], [(5, 60), (1, 10)])],
+    3: [([], [(6, 50)]), ([(1, 1, 0)], [(3, 50)])],
+    4: [
+        ([], [(2, 50)]),
+        ([(2, 2, 0), (3, 2, 0)], [(7, 100)]),
+        ([(2, 1, 0)], [(4, 50)]),
+    ],
+    5: [([], [(1, 50)]), ([(4, 2, 0), (1, 2, 1)], [(2, 120), (3, 10)])],
+}
+
+DERIVED = ("IO", "SR", "TT", "SR_T", "IT_T", "SI_T", "OR_T", "TR_T")
+
+
+def build_block(chain, number):
+    """A block's matrices built the same way as ``Block.build_graphs``."""
+    m = {s: ([], [], []) for s in ("BT", "IT", "TO", "SI", "OR", "ST", "TR")}
+
+    def add(suffix, *entry):
+        for column, value in zip(m[suffix], entry):
+            column.append(value)
+
+    for row, (inputs, outputs) in enumerate(BLOCKS[number], 1):
+        t = (number << 32) + (row << 16)
+        if not inputs:
+            add("IT", number << 32, t, 0)
+        for b, r, i in inputs:
+            a, v = BLOCKS[b][r - 1][1][i]
+            spent = (b << 32) + (r << 16) + i
+            add("IT", spent, t, v)
+            add("SI", a, spent, v)
+            add("ST", a, t, v)
+        for i, (a, v) in enumerate(outputs):
+            add("TO", t, t + i, v)
+            add("BT", number << 32, t, v)
+            add("OR", t + i, a, v)
+            add("TR", t, a, v)
+
+    block = Block(chain, number, f"{number:064x}")
+    for suffix, entries in m.items():
+        dup = binaryop.PLUS if suffix in ("BT", "ST", "TR") else binaryop.SECOND
+        setattr(block, suffix, build_matrix(UINT64, *entries, dup_op=dup))
+    return block
+
+
+@pytest.fixture
+def path(tmp_path):
+    chain = Chain("", tmp_path, pool_size=1)
+    for number in BLOCKS:
+        build_block(chain, number).write_block_files(tmp_path)
+    return tmp_path
+
+
+def blocks(chain, numbers):
+    return [Block(chain, n, f"{n:064x}") for n in numbers]
+
+
+def load(path, numbers, derived=DERIVED):
+    chain = Chain("", path, pool_size=1)
+    for block in blocks(chain, numbers):
+        chain.blocks[block.number] = block
+    chain.load_graphs()
+    for name in derived:
+        getattr(chain, name)
+    return chain
+
+
+def assert_same(chain, expected):
+    for name in ("BT", "IT", "TO", "SI", "OR", "ST", "TR") + DERIVED:
+        assert getattr(chain, name).iseq(getattr(expected, name)), name
+
+
+def test_first_use_loads_every_base_matrix(path):
+    chain = Chain("", path, pool_size=1)
+    for block in blocks(chain, range(6)):
+        chain.blocks[block.number] = block
+    chain.IT
+    assert all(suffix in chain.matrix_cache for suffix in SUFFIXES)
+    assert chain.load_stats["blocks"] == 6
+    assert_same(chain, load(path, range(6)))
+
+
+def test_append_blocks(path):
+    chain = load(path, range(4))
+    chain.append_blocks(blocks(chain, [4, 5]))
+    assert list(chain.blocks) == list(range(6))
+    assert_same(chain, load(path, range(6)))
+
+
+def test_append_blocks_unloaded_products(path):
+    chain = load(path, range(4), derived=("TT",))
+    chain.append_blocks(blocks(chain, [4, 5]))
+    assert_same(chain, load(path, range(6)))
+
+
+def test_drop_blocks(path):
+    chain = load(path, range(6))
+    chain.drop_blocks(0, 1)
+    assert list(chain.blocks) == list(range(2, 6))
+    assert_same(chain, load(path, range(2, 6)))
+
+
+def test_drop_last_blocks(path):
+    chain = load(path, range(6))
+    chain.drop_blocks(4, 5)
+    assert_same(chain, load(path, range(4)))
+
+
+def test_slide_blockspan(path):
+    chain = load(path, range(4))
+    chain.append_blockspan = lambda start, end: chain.append_blocks(
+        blocks(chain, range(start, end + 1))
+    )
+    chain.slide_blockspan(2, 5)
+    assert list(chain.blocks) == list(range(2, 6))
+    assert_same(chain, load(path, range(2, 6)))
+
+
+def test_poll_appends_committed_blocks(tmp_path, mocker):
+    chain = Chain("", tmp_path, pool_size=1)
+    chain.conn = mocker.MagicMock()
+    month = date(2012, 1, 1)
+    rows = [dict(number=n, hash=f"{n:064x}", timestamp_month=month) for n in (4, 5)]
+    mocker.patch.object(chain, "last_imported_block", return_value=(3, month))
+    mocker.patch.object(chain, "last_block", return_value=(5, month))
+    mocker.patch.object(chain, "unimported_blocks", return_value=rows)
+    for name in ("extend_month", "flush", "write_iddicts", "merge_iddicts"):
+        mocker.patch.object(chain, name)
+    append = mocker.patch.object(chain, "append_blocks")
+    chain.source = mocker.Mock()
+    chain.source.blocks.return_value = []
+    chain.source.transactions.return_value = [dict(b_number=4), dict(b_number=5)]
+    built = mocker.Mock(number=4, hash=rows[0]["hash"], tx_rows=[], new_addresses={})
+    mocker.patch.object(
+        chain, "build_block_graph", side_effect=[built, RuntimeError("block 5")]
+    )
+
+    with pytest.raises(RuntimeError):
+        chain.poll()
+    (appended,), _ = append.call_args
+    assert [b.number for b in appended] == [4]
+    assert chain.write_iddicts.call_args[0][0] == f"{month}_4_4"
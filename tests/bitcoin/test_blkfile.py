@@ -0,0 +1,133 @@
+import hashlib
+import struct
+from datetime import date, datetime, timezone
+
+from coinblas.bitcoin.blkfile import (
+    MAGIC,
+    BlkFileReader,
+    base58check,
+    parse_block,
+    ripemd160,
+    segwit_address,
+)
+
+GENESIS_HEADER = bytes.fromhex(
+    "01000000000000000000000000000000000000000000000000000000000000000000"
+    "00003ba3edfd7a7b12b27ac72c3e67768f617fc81bc3888a51323a9fb8aa4b1e5e4a"
+    "29ab5f49ffff001d1dac2b7c"
+)
+
+GENESIS_TX = bytes.fromhex(
+    "01000000010000000000000000000000000000000000000000000000000000000000"
+    "000000ffffffff4d04ffff001d0104455468652054696d65732030332f4a616e2f32"
+    "303039204368616e63656c6c6f72206f6e206272696e6b206f66207365636f6e6420"
+    "6261696c6f757420666f722062616e6b73ffffffff0100f2052a0100000043410467"
+    "8afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc"
+    "3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac00000000"
+)
+
+GENESIS = GENESIS_HEADER + b"\x01" + GENESIS_TX
+
+
+def test_addresses():
+    assert ripemd160(b"abc").hex() == "8eb208f7e05d987a9b044a8e98c6b087f15a0bfc"
+    assert (
+        base58check(0, bytes.fromhex("62e907b15cbf27d5425399ebf6f0fb50ebb88f18"))
+        == "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"
+    )
+    assert (
+        segwit_address(0, bytes.fromhex("751e76e8199196d454941c45d1b3a323f1433bd6"))
+        == "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4"
+    )
+    assert (
+        segwit_address(
+            1,
+            bytes.fromhex(
+                "79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798"
+            ),
+        )
+        == "bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0"
+    )
+
+
+def test_genesis(tmp_path):
+    bhash, txs = parse_block(GENESIS)
+    assert bhash == "000000000019d6689c085ae165831e934ff763ae46a2a6c172b3f1b60a8ce26f"
+    txid, inputs, outputs = txs[0]
+    assert txid == "4a5e1e4baab89f3a32518a88c31bc87f618f76673e2cc77ab2127b7afdeda33b"
+    assert outputs == [(5000000000, ["1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa"])]
+
+    blk = MAGIC + struct.pack("<I", len(GENESIS)) + GENESIS
+    (tmp_path / "blk00000.dat").write_bytes(blk + bytes(64))
+    reader = BlkFileReader(tmp_path)
+    assert [b["hash"] for b in reader.blocks()] == [bhash]
+    rows = list(reader.transactions(date(2009, 1, 1)))
+    assert len(rows) == 1
+    assert rows[0]["t_id"] == 1 << 16
+    assert rows[0]["i_spent_tid"] is None
+    assert rows[0]["o_value"] == 5000000000
+
+
+def coinbase(n):
+    return (
+        struct.pack("<IB", 1, 1)
+        + bytes(32)
+        + struct.pack("<IBB", 0xFFFFFFFF, 1, n)
+        + struct.pack("<IBQB", 0xFFFFFFFF, 1, 5000000000, 25)
+        + bytes.fromhex("76a914")
+        + bytes(20)
+        + bytes.fromhex("88ac")
+        + struct.pack("<I", 0)
+    )
+
+
+def blkfile(times):
+    """A blk file of one coinbase block per ``(year, month, day)``."""
+    prev = bytes(32)
+    blk = b""
+    for n, t in enumerate(times):
+        stamp = int(datetime(*t, tzinfo=timezone.utc).timestamp())
+        header = struct.pack("<I", 1) + prev + bytes(32)
+        header += struct.pack("<III", stamp, 0x1D00FFFF, n)
+        block = header + b"\x01" + coinbase(n)
+        blk += MAGIC + struct.pack("<I", len(block)) + block
+        prev = hashlib.sha256(hashlib.sha256(header).digest()).digest()
+    return blk
+
+
+def test_months_out_of_order(tmp_path):
+    # block 2 is timestamped in January, after block 1 in February
+    times = [(2009, 1, 3), (2009, 2, 1), (2009, 1, 31), (2009, 2, 2)]
+    (tmp_path / "blk00000.dat").write_bytes(blkfile(times))
+
+    reader = BlkFileReader(tmp_path)
+    january = list(reader.transactions(date(2009, 1, 1)))
+    assert [r["b_number"] for r in january] == [0, 2]
+    assert list(reader.parked) == [1]
+
+    resets = []
+    reset = reader.reset
+    reader.reset = lambda: resets.append(reset())
+    february = list(reader.transactions(date(2009, 2, 1)))
+    assert [r["b_number"] for r in february] == [1, 3]
+    assert not resets
+    assert reader.parked == {}
+    assert reader.height == 4
+
+    again = list(reader.transactions(date(2009, 1, 1)))
+    assert [r["b_number"] for r in again] == [0, 2]
+    assert resets
+
+
+def test_blocks_after(tmp_path):
+    times = [(2009, 1, 3), (2009, 1, 4), (2009, 1, 5)]
+    blk = blkfile(times)
+    first = blkfile(times[:2])
+    # the last block is only partly written
+    (tmp_path / "blk00000.dat").write_bytes(blk[: len(first) + 100])
+    reader = BlkFileReader(tmp_path)
+    assert [b["number"] for b in reader.blocks()] == [0, 1]
+    assert [b["number"] for b in reader.blocks(after=1)] == []
+
+    (tmp_path / "blk00000.dat").write_bytes(blk)
+    assert [b["number"] for b in reader.blocks(after=1)] == [2]
@@ -0,0 +1,18 @@
+import numpy as np
+
+from coinblas.bitcoin.flow import fifo
+
+
+def test_fifo():
+    # one tx spending two inputs of 5 into outputs of 3 and 7
+    assert fifo([1, 1], [5, 5], [5, 0], [1, 1], [3, 7]).tolist() == [3, 2]
+    assert fifo([1, 1], [5, 5], [0, 5], [1, 1], [3, 7]).tolist() == [0, 5]
+    assert fifo([1, 1], [5, 5], [2, 0], [1, 1], [3, 7]).tolist() == [2, 0]
+
+    # a fee of 1 is paid after the outputs, and a second untainted tx
+    # gets nothing from the first
+    taint = fifo([1, 2], [4, 10], [4, 0], [1, 1, 2], [1, 2, 10])
+    assert taint.tolist() == [1, 2, 0]
+    taint = fifo([1, 2], [4, 10], [0, 6], [1, 1, 2], [1, 2, 10])
+    assert taint.tolist() == [0, 0, 6]
+    assert np.isclose(fifo([1], [4], [3], [1, 1], [2, 2]).sum(), 3)
@@ -0,0 +1,73 @@
+from coinblas.bitcoin.iddict import IdDict
+
+
+def test_iddict(tmp_path):
+    d = IdDict(tmp_path / "tx")
+    assert d.id("nothing") is None
+    assert d.key(1) is None
+
+    d.write("2012-01-01", [(1 << 32, "aa"), (2 << 32, "bbbb"), (3 << 32, "")])
+    d.write("2012-02-01", [(5 << 32, "cc"), (4 << 32, "dd")])
+    assert len(d) == 5
+    assert d.id("bbbb") == 2 << 32
+    assert d.id("dd") == 4 << 32
+    assert d.key(5 << 32) == "cc"
+    assert d.key(3 << 32) == ""
+    assert d.key(6 << 32) is None
+    assert d.id("ee") is None
+
+    d.write("2012-02-01", [(4 << 32, "dd")])
+    assert d.id("cc") is None
+    assert IdDict(tmp_path / "tx").key(4 << 32) == "dd"
+
+
+def test_merge(tmp_path):
+    d = IdDict(tmp_path / "tx")
+    d.write("2012-01-01", [(1 << 32, "aa")])
+    d.write("2012-01-01_2_2", [(2 << 32, "bb")])
+    d.write("2012-01-01_3_4", [(3 << 32, "cc"), (4 << 32, "dd")])
+    d.write("2012-02-01_5_5", [(5 << 32, "ee")])
+    d.merge("2012-01-01", ["2012-01-01_2_2", "2012-01-01_3_4"])
+    assert [s.path.name for s in d.segments] == ["2012-01-01", "2012-02-01_5_5"]
+    assert len(d) == 5
+    assert d.id("cc") == 3 << 32
+    assert d.key(1 << 32) == "aa"
+    assert d.key(5 << 32) == "ee"
+    assert sorted(p.name for p in (tmp_path / "tx").iterdir()) == [
+        "2012-01-01",
+        "2012-02-01_5_5",
+    ]
+
+
+def test_index(tmp_path):
+    d = IdDict(tmp_path / "tx")
+    d.write("2012-01-01", [(1 << 32, "aa"), (2 << 32, "bb")])
+    d.write("2012-02-01", [(3 << 32, "cc")])
+    d.reindex()
+    assert d.unindexed == []
+    assert d.id("bb") == 2 << 32
+    assert d.id("cc") == 3 << 32
+    assert d.id("zz") is None
+
+    # segments written or merged after the index are searched on their own
+    d.write("2012-02-01_4_4", [(4 << 32, "dd")])
+    d.write("2012-01-01", [(1 << 32, "aa"), (5 << 32, "ee")])
+    assert [s.path.name for s in d.unindexed] == ["2012-01-01", "2012-02-01_4_4"]
+    assert d.id("dd") == 4 << 32
+    assert d.id("ee") == 5 << 32
+    assert d.id("bb") is None
+    assert d.id("cc") == 3 << 32
+
+    d.reindex()
+    assert d.unindexed == []
+    assert IdDict(tmp_path / "tx").id("dd") == 4 << 32
+    assert d.id("bb") is None
+
+
+def test_write_nothing(tmp_path):
+    d = IdDict(tmp_path / "tx")
+    d.write("2012-01-01", [(1 << 32, "aa")])
+    d.write("2012-01-01", [])
+    d.write("2012-02-01", [])
+    assert d.segments == []
+    assert list((tmp_path / "tx").iterdir()) == []
@@ -0,0 +1,65 @@
+from datetime import date
+
+from coinblas.bitcoin.source import (
+    RecordSource,
+    ReplaySource,
+    Source,
+    read_columns,
+    write_columns,
+)
+
+
+class ListSource(Source):
+    def __init__(self, blocks, txs):
+        self._blocks = blocks
+        self._txs = txs
+
+    def blocks(self, after=None):
+        return [b for b in self._blocks if after is None or b["number"] > after]
+
+    def transactions(self, month, start=None, end=None):
+        return [
+            t
+            for t in self._txs
+            if (start is None or t["b_number"] >= start)
+            and (end is None or t["b_number"] <= end)
+        ]
+
+
+def test_record_replay(tmp_path):
+    blocks = [
+        dict(number=n, hash=f"h{n}", timestamp=None, timestamp_month=date(2012, 1, 1))
+        for n in range(3)
+    ]
+    txs = [
+        dict(t_id=(n << 32) + (1 << 16), b_number=n, o_index=0, o_value=n)
+        for n in range(3)
+    ]
+    recorded = RecordSource(ListSource(blocks, txs), tmp_path)
+    assert list(recorded.blocks()) == blocks
+    assert list(recorded.transactions("2012-01-01")) == txs
+
+    replay = ReplaySource(tmp_path)
+    assert replay.blocks() == blocks
+    assert replay.blocks(after=1) == blocks[2:]
+    assert replay.transactions("2012-01-01") == txs
+    assert replay.transactions("2012-01-01", 1, 1) == txs[1:2]
+
+    # a poll records the new blocks after those already recorded
+    assert recorded.blocks(after=1) == blocks[2:]
+    assert replay.blocks() == blocks
+
+
+def test_columns(tmp_path):
+    rows = [
+        dict(b_number=n, t_hash=f"t{n}{i}", i_value=None if i else n, o_addresses=a)
+        for n in (3, 5, 8)
+        for i, a in enumerate([["a", "b"], None])
+    ]
+    write_columns(tmp_path / "month", rows)
+    assert read_columns(tmp_path / "month") == rows
+    assert read_columns(tmp_path / "month", 4, 8) == rows[2:]
+    assert read_columns(tmp_path / "month", 4, 7) == rows[2:4]
+    assert read_columns(tmp_path / "month", 6, 7) == []
+    write_columns(tmp_path / "empty", [])
+    assert read_columns(tmp_path / "empty", 1, 2) == []
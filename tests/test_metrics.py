@@ -0,0 +1,74 @@
+import io
+import json
+
+from coinblas.metrics import Metrics, Progress
+
+
+def test_metrics(tmp_path):
+    m = Metrics()
+    m.trace = io.StringIO()
+    with m.span("build"):
+        pass
+    with m.span("build"):
+        pass
+
+    @m.timed("parse")
+    def parse(x):
+        return x + 1
+
+    assert parse(1) == 2
+    assert list(m.iterate("fetch", range(3))) == [0, 1, 2]
+    m.count("rows", 10)
+    m.count("rows", 5)
+
+    s = m.snapshot()
+    assert s["spans"]["build"]["calls"] == 2
+    assert s["spans"]["parse"]["calls"] == 1
+    assert s["spans"]["fetch"]["calls"] == 3
+    assert s["counters"] == {"rows": 15}
+    assert s["rss"] > 0
+    assert len(m.trace.getvalue().splitlines()) == 3
+
+    m.write(tmp_path / "metrics.jsonl")
+    lines = [json.loads(l) for l in open(tmp_path / "metrics.jsonl")]
+    assert {"counter": "rows", "value": 15}.items() <= lines[-1].items()
+
+    m.write(tmp_path / "metrics.prom")
+    prom = open(tmp_path / "metrics.prom").read()
+    assert 'coinblas_span_calls_total{span="build"} 2' in prom
+    assert "coinblas_rows_total 15" in prom
+
+    m.reset()
+    assert m.snapshot()["counters"] == {}
+
+
+def test_progress():
+    p = Progress(10)
+    assert p.eta is None
+    assert "ETA unknown" in str(p)
+    p.update(4, txs=100)
+    p.update(1, txs=50)
+    assert p.done == 5
+    assert p.counts == {"txs": 150}
+    assert p.eta >= 0
+    assert str(p).startswith("5/10 blocks, ")
+    assert "txs/s" in str(p)
+
+
+def test_merge():
+    worker = Metrics()
+    with worker.span("build"):
+        pass
+    worker.count("rows", 10)
+
+    m = Metrics()
+    with m.span("build"):
+        pass
+    m.count("rows", 5)
+    m.merge(worker.snapshot())
+    m.merge(worker.snapshot())
+
+    s = m.snapshot()
+    assert s["spans"]["build"]["calls"] == 3
+    assert s["spans"]["build"]["seconds"] >= worker.seconds["build"] * 2
+    assert s["counters"] == {"rows": 25}
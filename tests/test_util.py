@@ -0,0 +1,32 @@
+import threading
+from itertools import count
+
+import pytest
+
+from coinblas.util import pipeline
+
+
+def test_pipeline():
+    assert list(pipeline(range(20), lambda x: x + 1, lambda x: 2 * x)) == [
+        2 * (x + 1) for x in range(20)
+    ]
+
+
+def test_pipeline_error():
+    def fail(x):
+        if x == 5:
+            raise ValueError(x)
+        return x
+
+    with pytest.raises(ValueError):
+        list(pipeline(range(20), fail, maxsize=2))
+
+
+def test_pipeline_stopped_early():
+    before = threading.active_count()
+    results = pipeline(count(), lambda x: x, lambda x: x, maxsize=1)
+    for x in results:
+        if x == 3:
+            break
+    results.close()
+    assert threading.active_count() == before